@@ -0,0 +1,170 @@
+"""Benchmarks of the lens-geometry hot paths, for airspeed velocity (asv).
+
+Run them with:
+
+    asv run
+    asv compare HEAD~1 HEAD
+
+The time_* methods measure the run time, the track_* methods the throughput
+(points per second) and the peakmem_* methods the peak memory.
+
+The suite runs on any commit since the baseline: the benchmarks of features
+missing from a commit (array-valued critic_2l, shape(codes=True), the out
+argument of to_frame) are skipped there, since their setup raises
+NotImplementedError.
+"""
+import inspect
+import numpy as np
+import time
+
+from moana.frames import LensReferenceFrame
+from moana.lens import (ResonantCaustic, close_limit_2l, critic_2l,
+                        get_dzeta_phi, shape, wk)
+
+
+def _require(available, feature):
+    """Skip a benchmark (in its setup) if a feature is not available."""
+    if not available:
+        raise NotImplementedError(f'{feature} is not available in this commit')
+
+def _throughput(func, n):
+    """Number of points per second of func, processing n points."""
+    start = time.perf_counter()
+    func()
+    return n / (time.perf_counter() - start)
+
+
+class CriticCurves:
+    params = [1000, 100000]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.phi = np.linspace(0, 2 * np.pi, n, endpoint=False)
+        try:
+            self.z = critic_2l(1.0, 1e-3, self.phi)
+        except (TypeError, ValueError):
+            self.z = None
+        _require(np.shape(self.z) == (n, 4), 'array-valued critic_2l')
+
+    def time_critic_2l(self, n):
+        critic_2l(1.0, 1e-3, self.phi)
+
+    def peakmem_critic_2l(self, n):
+        critic_2l(1.0, 1e-3, self.phi)
+
+    def track_critic_2l_throughput(self, n):
+        return _throughput(lambda: critic_2l(1.0, 1e-3, self.phi), n)
+    track_critic_2l_throughput.unit = 'angles/s'
+
+    def time_get_dzeta_phi(self, n):
+        get_dzeta_phi(1.0, 1e-3, self.z)
+
+    def peakmem_get_dzeta_phi(self, n):
+        get_dzeta_phi(1.0, 1e-3, self.z)
+
+    def track_get_dzeta_phi_throughput(self, n):
+        return _throughput(lambda: get_dzeta_phi(1.0, 1e-3, self.z), 4 * n)
+    track_get_dzeta_phi_throughput.unit = 'points/s'
+
+
+class Wk:
+    params = ([10000, 1000000], [1, 5])
+    param_names = ['n', 'k']
+
+    def setup(self, n, k):
+        rng = np.random.default_rng(0)
+        self.z = rng.normal(size=n) + 1j * rng.normal(size=n)
+        self.affix = np.array([0.0, -1.0])
+        self.eps = np.array([1.0 / 1.001, 0.001 / 1.001])
+
+    def time_wk(self, n, k):
+        wk(self.z, self.affix, self.eps, k)
+
+    def peakmem_wk(self, n, k):
+        wk(self.z, self.affix, self.eps, k)
+
+    def track_wk_throughput(self, n, k):
+        return _throughput(lambda: wk(self.z, self.affix, self.eps, k), n)
+    track_wk_throughput.unit = 'points/s'
+
+
+class SampleCaustic:
+    params = ([100, 1000, 10000], [False, True])
+    param_names = ['ntot', 'uniform']
+    timeout = 300
+
+    def setup(self, ntot, uniform):
+        self.caustic = ResonantCaustic(sep=1.0, q=1e-3)
+
+    def time_sample(self, ntot, uniform):
+        self.caustic._sample(ntot, uniform=uniform)
+
+    def peakmem_sample(self, ntot, uniform):
+        self.caustic._sample(ntot, uniform=uniform)
+
+
+class Topology:
+    params = [10000, 1000000]
+    param_names = ['n']
+
+    def setup(self, n):
+        _require('codes' in inspect.signature(shape).parameters,
+                 'shape(codes=True)')
+        rng = np.random.default_rng(0)
+        self.s = rng.uniform(0.2, 4.0, n)
+        self.q = 10**rng.uniform(-6, 0, n)
+
+    def time_close_limit_2l(self, n):
+        close_limit_2l(self.q)
+
+    def time_shape(self, n):
+        shape(self.s, self.q, codes=True)
+
+    def peakmem_shape(self, n):
+        shape(self.s, self.q, codes=True)
+
+    def track_shape_throughput(self, n):
+        return _throughput(lambda: shape(self.s, self.q, codes=True), n)
+    track_shape_throughput.unit = 'models/s'
+
+
+class Frames:
+    params = [10000, 1000000]
+    param_names = ['n']
+
+    def setup(self, n):
+        rng = np.random.default_rng(0)
+        self.z = rng.normal(size=n) + 1j * rng.normal(size=n)
+        self.sep = rng.uniform(0.5, 2.0, n)
+        self.gl1 = 0.01 * self.sep
+        self.old = LensReferenceFrame(center='barycenter', x_axis='12')
+        self.new = LensReferenceFrame(center='primary', x_axis='21')
+
+    def time_to_frame(self, n):
+        self.old.to_frame(self.z, self.new, sep=self.sep, gl1=self.gl1)
+
+    def peakmem_to_frame(self, n):
+        self.old.to_frame(self.z, self.new, sep=self.sep, gl1=self.gl1)
+
+    def track_to_frame_throughput(self, n):
+        return _throughput(lambda: self.old.to_frame(
+            self.z, self.new, sep=self.sep, gl1=self.gl1), n)
+    track_to_frame_throughput.unit = 'points/s'
+
+
+class FramesOut:
+    """to_frame writing into a preallocated array."""
+    params = Frames.params
+    param_names = Frames.param_names
+
+    def setup(self, n):
+        Frames.setup(self, n)
+        # A separate buffer, so that z is the same at each repeat
+        self.out = np.empty_like(self.z)
+        out = self.old.to_frame(self.z[:1], self.new, sep=self.sep[:1],
+                                gl1=self.gl1[:1], out=self.out[:1])
+        _require(np.shares_memory(out, self.out), 'to_frame(out=...)')
+
+    def time_to_frame_out(self, n):
+        self.old.to_frame(self.z, self.new, sep=self.sep, gl1=self.gl1,
+                          out=self.out)
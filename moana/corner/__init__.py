@@ -1,3 +1,3 @@
-from .tools import compute_2dcontours
+from .tools import compute_2dcontours, histogram_2dcontours, smooth_histogram
 
-__all__ = ['compute_2dcontours']
\ No newline at end of file
+__all__ = ['compute_2dcontours', 'histogram_2dcontours', 'smooth_histogram']
\ No newline at end of file
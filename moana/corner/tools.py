@@ -1,11 +1,9 @@
 import numpy as np
+from scipy.signal import fftconvolve
 
 # Two-dimensional contour computation
-def compute_2dcontours(x, y, bins=50, cdf_levels=None, weights=None):
-    
-    # Choose the default "sigma" contour levels.
-    if cdf_levels is None:
-        cdf_levels = 1 - np.exp(-0.5 * np.array([1.0, 2.0, 3.0])**2)
+def compute_2dcontours(x, y, bins=50, cdf_levels=None, weights=None,
+        smooth=None):
 
     # We'll make the 2D histogram to directly estimate the density.
     try:
@@ -16,26 +14,33 @@ def compute_2dcontours(x, y, bins=50, cdf_levels=None, weights=None):
             "have no dynamic range. You could try using the "
             "'range' argument."
         )
-    
+
+    return histogram_2dcontours(hist, xedges, yedges, cdf_levels=cdf_levels,
+                                smooth=smooth)
+
+# Two-dimensional contours from an existing histogram
+def histogram_2dcontours(hist, xedges, yedges, cdf_levels=None, smooth=None):
+
+    # Choose the default "sigma" contour levels.
+    if cdf_levels is None:
+        cdf_levels = 1 - np.exp(-0.5 * np.array([1.0, 2.0, 3.0])**2)
+
+    # [Optional] Smooth the density with a Gaussian kernel (FFT convolution);
+    # smooth is the standard deviation in number of bins, along x and y.
+    if smooth is not None:
+        hist = smooth_histogram(hist, smooth)
+
     # Compute the bin centers
     xcenter = 0.5 * (np.roll(xedges, -1) + xedges)[:-1]
     ycenter = 0.5 * (np.roll(yedges, -1) + yedges)[:-1]
-    
+
     # Compute the density levels
     hist1d = hist.flatten()
     hist1d = hist1d[np.argsort(hist1d)[::-1]]
     cumul = np.cumsum(hist1d)
-    if weights is not None:
-        print("Test for weighted histogram: okay is {:.9e} ~ 0.".format(
-        cumul[-1] - np.cumsum(weights)[-1]))
     cumul = cumul / cumul[-1]
-    levels = np.zeros(len(cdf_levels))
-    for i in range(len(cdf_levels)):
-        try:
-            levels[i] = hist1d[cumul <= cdf_levels[i]][-1]
-        except:
-            levels[i] = hist1d[0]
-    levels = np.sort(levels)
+    k = np.searchsorted(cumul, cdf_levels, side='right') - 1
+    levels = np.sort(hist1d[np.maximum(k, 0)])
     
     # [Optional] Increase array size for plots
     hist2 = hist.min() + np.zeros((hist.shape[0] + 4, hist.shape[1] + 4))
@@ -59,25 +64,20 @@ def compute_2dcontours(x, y, bins=50, cdf_levels=None, weights=None):
     
     return xcenter2, ycenter2, hist2, levels
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Gaussian smoothing of a 2D histogram
+def smooth_histogram(hist, sigma):
+
+    # Truncated Gaussian kernel, separable along x and y
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), (2,))
+    kernels = []
+    for sig in sigma:
+        if sig > 0:
+            u = np.arange(-int(np.ceil(4 * sig)), int(np.ceil(4 * sig)) + 1)
+            kernel = np.exp(-0.5 * (u / sig)**2)
+            kernels.append(kernel / kernel.sum())
+        else:
+            kernels.append(np.ones(1))
+    kernel = np.outer(kernels[0], kernels[1])
+
+    # The convolution may give tiny negative values
+    return np.clip(fftconvolve(hist, kernel, mode='same'), 0, None)
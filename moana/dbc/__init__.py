@@ -1,5 +1,6 @@
 from .instruments import Dataset
 from .io import Output
+from .model import source_trajectory, magnification, check_model, fit_flux, chi2
 from .tools import from_parfile, mass_fration_to_mass_ratio, custom_floor
 
 __all__ = ["Dataset", "Output"]
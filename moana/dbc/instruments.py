@@ -28,6 +28,8 @@ class Dataset:
     Attributes:
         instruments: :obj:`pandas.DataFrame` with all the parameters of each instrument.
             Keywords are the same as in the par* files.
+        photometry: :obj:`pandas.DataFrame` of the data of all the instruments,
+            see :meth:`load_photometry`.
 
     """
     def __init__(self, dataset: str, path: str = '.'):
@@ -86,3 +88,37 @@ class Dataset:
                 & (self.instruments.jclr <= 59)
         self.instruments.at[mask, 'data_type'] = 'flux'
 
+
+    def load_photometry(self) -> pd.DataFrame:
+        """Load the light curves of all the instruments with a lc file.
+
+        The first three columns of the files are read as date, measurement and
+        uncertainty. Magnitudes are converted to fluxes, with a zero point of
+        21 for 'mag21' data and 0 for 'mag0' data. The uncertainties are
+        rescaled as fudge * sqrt(err^2 + errmin^2), in magnitudes for
+        magnitude data, and as fudge * err for flux data.
+
+        Returns:
+            :obj:`pandas.DataFrame` with columns date, flux, err_flux, sfx and
+                instrument (row number in :obj:`Dataset.instruments`), also
+                stored in the attribute photometry.
+        """
+        tables = []
+        for i in np.flatnonzero(self.instruments['lcfile'].to_numpy()):
+            inst = self.instruments.iloc[i]
+            fname = f"{self.path}/lc{self.dataset}.{inst['sfx']}"
+            x = pd.read_table(fname, sep='\s+', names=['date', 'value', 'err'],
+                              usecols=[0, 1, 2], dtype=np.float64, comment='#')
+            if inst['data_type'] == 'flux':
+                flux = x['value'].to_numpy()
+                err_flux = inst['fudge'] * x['err'].to_numpy()
+            else:
+                zero_point = 21.0 if inst['data_type'] == 'mag21' else 0.0
+                err = inst['fudge'] * np.sqrt(x['err']**2 + inst['errmin']**2)
+                flux = np.power(10, -0.4 * (x['value'].to_numpy() - zero_point))
+                err_flux = 0.4 * np.log(10) * flux * err.to_numpy()
+            tables.append(pd.DataFrame({'date': x['date'], 'flux': flux,
+                'err_flux': err_flux, 'sfx': inst['sfx'], 'instrument': i}))
+
+        self.photometry = pd.concat(tables, ignore_index=True)
+        return self.photometry
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+from moana.frames import LensReferenceFrame
+import moana.lens as lens
+import numpy as np
+import pandas as pd
+from typing import Tuple, Union
+
+def source_trajectory(param: Union[pd.Series, pd.DataFrame],
+        date: np.ndarray) -> np.ndarray:
+    """Compute the source positions of one or many models.
+
+    The source moves along a straight line, in the frame centered on the
+    barycenter of the lenses with the x-axis from the primary to the
+    secondary. With tau = (date - t0) / t_E, the position is:
+    zeta = tau (cos alpha + i sin alpha) + i u0 (cos alpha + i sin alpha),
+    where alpha is in radians.
+
+    Args:
+        param: model parameters, e.g. :obj:`moana.dbc.Output.param`, or a
+            table with one model per row (columns t0, t_E, u0, alpha).
+        date: array (shape: n) of the epochs.
+
+    Returns:
+        Array (type: complex) of the source positions, with shape (n,) for a
+            single model, and (number of models, n) for a table.
+    """
+    table, single = _as_table(param)
+    date = np.asarray(date, dtype=float)
+    tau = (date[None, :] - table['t0'].to_numpy()[:, None])\
+        / table['t_E'].to_numpy()[:, None]
+    u0 = table['u0'].to_numpy()[:, None]
+    alpha = table['alpha'].to_numpy()[:, None]
+    zeta = (tau + 1j * u0) * np.exp(1j * alpha)
+    if single:
+        return zeta[0]
+    return zeta
+
+def magnification(param: Union[pd.Series, pd.DataFrame],
+        date: np.ndarray,
+        tol: float = 1e-3) -> np.ndarray:
+    """Compute the magnification of one or many models at given epochs.
+
+    The lens is a single lens if eps1 is 0 (or missing), and a binary lens of
+    separation sep and planet mass fraction eps1 otherwise. The source is
+    uniform, with radius rho = Tstar / t_E (point source if Tstar is 0 or
+    missing).
+
+    Args:
+        param: model parameters, e.g. :obj:`moana.dbc.Output.param`, or a
+            table with one model per row (columns t0, t_E, u0, alpha, and
+            optionally sep, eps1 and Tstar).
+        date: array (shape: n) of the epochs.
+        tol: relative precision of the finite-source magnification.
+
+    Returns:
+        Array of the magnification, with the same shape as the output of
+            :func:`source_trajectory`.
+    """
+    table, single = _as_table(param)
+    zeta = source_trajectory(table, date)
+    eps1 = table['eps1'].to_numpy() if 'eps1' in table else np.zeros(len(table))
+    tstar = table['Tstar'].to_numpy() if 'Tstar' in table else np.zeros(len(table))
+    rho = tstar / table['t_E'].to_numpy()
+    binary = eps1 > 0
+    frame = LensReferenceFrame(center='barycenter', x_axis='12')
+    mgf = np.empty(zeta.shape)
+
+    # Single lens
+    idx = ~binary
+    mgf[idx] = lens.magnification_fs_1l(np.abs(zeta[idx]), rho[idx, None])
+
+    # Binary lens, point source, all the models at once
+    idx = binary & (rho <= 0)
+    if np.any(idx):
+        sep = table['sep'].to_numpy()[idx, None]
+        q = eps1[idx, None] / (1.0 - eps1[idx, None])
+        mgf[idx] = lens.magnification_2l(sep, q, zeta[idx], frame=frame)
+
+    # Binary lens, finite source, all the models at once
+    idx = binary & (rho > 0)
+    if np.any(idx):
+        sep = table['sep'].to_numpy()[idx, None]
+        q = eps1[idx, None] / (1.0 - eps1[idx, None])
+        mgf[idx] = lens.magnification_fs_2l(sep, q, zeta[idx], rho[idx, None],
+                                            frame=frame, tol=tol)
+
+    if single:
+        return mgf[0]
+    return mgf
+
+def check_model(output, tol: float = 1e-3) -> Tuple[bool, pd.DataFrame]:
+    """Compare the magnification of a model with the one in the resid file.
+
+    Args:
+        output: a :obj:`moana.dbc.Output` loaded with resid=True.
+        tol: maximum relative difference between the magnifications.
+
+    Returns:
+        Tuple with True if all the data agree within tol, and a table with
+            columns date, sfx, mgf_model (from the resid file), mgf (this
+            model), rel_diff and ok. If the fit.lc file is loaded, the
+            distance between the source trajectory and its xs, ys columns is
+            given in the attribute 'max_distance' of the table.
+    """
+    date = output.resid['date'].to_numpy()
+    mgf = magnification(output.param, date, tol=0.1 * tol)
+    check = pd.DataFrame({'date': date, 'sfx': output.resid['sfx'].to_numpy(),
+                          'mgf_model': output.resid['mgf_model'].to_numpy(),
+                          'mgf': mgf})
+    check['rel_diff'] = np.abs(check['mgf'] / check['mgf_model'] - 1)
+    check['ok'] = check['rel_diff'] <= tol
+
+    if hasattr(output, 'fitlc'):
+        zeta = source_trajectory(output.param, output.fitlc['date'].to_numpy())
+        xy = output.fitlc['xs'].to_numpy() + 1j * output.fitlc['ys'].to_numpy()
+        check.attrs['max_distance'] = float(np.max(np.abs(zeta - xy)))
+
+    return bool(check['ok'].all()), check
+
+def fit_flux(mgf: np.ndarray, flux: np.ndarray, err: np.ndarray,
+        instrument: np.ndarray) -> dict:
+    """Fit the source and blend fluxes of many models at once.
+
+    For each model and each instrument k, the fluxes F = fs_k A + fb_k
+    minimizing the chi^2 are given by the weighted linear least squares,
+    solved from the sums of w, w A, w A^2, w F and w A F, with w = 1/err^2.
+    The sums of all the models and instruments are computed with matrix
+    products.
+
+    Args:
+        mgf: array (shape: number of models, n) of the magnifications.
+        flux: array (shape: n) of the measured fluxes.
+        err: array (shape: n) of the flux uncertainties.
+        instrument: array (shape: n, type: int) of the instrument number of
+            each measurement.
+
+    Returns:
+        Dictionary with 'chi2' (shape: number of models), and 'chi2_inst',
+            'fs', 'fb' (shape: number of models, number of instruments).
+    """
+    mgf = np.atleast_2d(mgf)
+    flux, err = np.asarray(flux, dtype=float), np.asarray(err, dtype=float)
+    instrument = np.unique(np.asarray(instrument), return_inverse=True)[1]
+    ninst = instrument.max() + 1
+
+    # Weights of each measurement for each instrument
+    w = 1.0 / err**2
+    onehot = np.zeros((flux.shape[0], ninst))
+    onehot[np.arange(flux.shape[0]), instrument] = w
+
+    s_w = np.sum(onehot, axis=0)
+    s_f = flux @ onehot
+    s_a = mgf @ onehot
+    s_aa = (mgf**2) @ onehot
+    s_af = (mgf * flux) @ onehot
+    det = s_w * s_aa - s_a**2
+    fs = (s_w * s_af - s_a * s_f) / det
+    fb = (s_aa * s_f - s_a * s_af) / det
+
+    res = flux - fs[:, instrument] * mgf - fb[:, instrument]
+    chi2_inst = (res**2) @ onehot
+    return {'chi2': np.sum(chi2_inst, axis=-1), 'chi2_inst': chi2_inst,
+            'fs': fs, 'fb': fb}
+
+def chi2(param: Union[pd.Series, pd.DataFrame],
+        dataset,
+        tol: float = 1e-3) -> dict:
+    """Compute the chi^2 of one or many models.
+
+    Args:
+        param: model parameters, see :func:`magnification`.
+        dataset: a :obj:`moana.dbc.Dataset`; its photometry is loaded with
+            :meth:`moana.dbc.Dataset.load_photometry` if needed.
+        tol: relative precision of the finite-source magnification.
+
+    Returns:
+        Dictionary of :func:`fit_flux`, where the instruments are the sorted
+            rows of :obj:`moana.dbc.Dataset.instruments` with data.
+    """
+    if getattr(dataset, 'photometry', None) is None:
+        dataset.load_photometry()
+    data = dataset.photometry
+    mgf = magnification(param, data['date'].to_numpy(), tol=tol)
+    return fit_flux(mgf, data['flux'].to_numpy(), data['err_flux'].to_numpy(),
+                    data['instrument'].to_numpy())
+
+def _as_table(param):
+    """Models as a table, and True if a single model was given."""
+    if isinstance(param, pd.Series):
+        return param.to_frame().T.astype(float).reset_index(drop=True), True
+    return param.reset_index(drop=True), False
@@ -1,11 +1,12 @@
+import concurrent.futures
 import matplotlib as mpl
 import matplotlib.pyplot as plt
-from matplotlib.ticker import MultipleLocator, MaxNLocator, AutoMinorLocator
+from matplotlib.ticker import MultipleLocator, AutoMinorLocator
 import moana
 import numpy as np
+import os
 import pandas as pd
-import scipy
-from scipy.interpolate import interp1d
+import sys
 from scipy.optimize import minimize
 
 class SampledPosterior:
@@ -14,28 +15,64 @@ class SampledPosterior:
     Args:
         sample: sample for 1+ parameters.
         labels: labels of columns to include in statistics.
+        limit: list of probability values of the credible intervals.
+        weights: weights of the sample, given as the label of a column of
+            sample, or as an array. The cumulative functions, the credible
+            intervals and the 2D contours are then weighted.
 
     Attributes:
         sample: :obj:`pandas.DataFrame` of the parameters.
+        weights: :obj:`numpy.array` of the weights, or None.
         cdf: dict and for each label, cdf[label] is a :obj:`numpy.array` with
             sorted values in cdf[label][0] and the cumulative function in
             cdf[label][1].
+        ci: dict and for each label, ci[label] is a :obj:`numpy.array` with
+            the values of the parameter at the probabilities of limit.
     """
-    def __init__(self, sample: pd.DataFrame, labels: list, limit=None):
+    def __init__(self, sample: pd.DataFrame, labels: list, limit=None,
+            weights=None):
         self.sample = sample
         self.request = labels
 
+        if isinstance(weights, str):
+            self.weights = self.sample[weights].to_numpy(dtype=float)
+        elif weights is not None:
+            self.weights = np.asarray(weights, dtype=float)
+        else:
+            self.weights = None
+
         if limit == None:
             self.limit = [0.1585, 0.5, 0.8415]
         else:
             self.limit = limit
 
+        # Sorted columns and their cumulative functions, computed once and
+        # reused for any new probability
+        self._sorted = dict()
+        self._cumul = dict()
+
         self.cdf = dict()
-        self.ci = dict()
-        
         for l in self.request:
             self.cdf.update({l: self.build_cdf(l)})
-            self.ci.update({l: self.find_limits(l, self.limit)})
+        self.ci = self.quantiles(self.limit, self.request)
+
+    def _sort_columns(self, labels: list):
+        """Sort the columns not sorted yet, all at once."""
+        missing = [l for l in dict.fromkeys(labels) if not l in self._sorted]
+        if len(missing) == 0:
+            return
+        values = self.sample[missing].to_numpy().T
+        if self.weights is None:
+            values = np.sort(values, axis=1)
+            n = len(self.sample)
+            cumul = [(np.arange(n) + 1) / n] * len(missing)
+        else:
+            idx = np.argsort(values, axis=1)
+            values = np.take_along_axis(values, idx, axis=1)
+            cumul = np.cumsum(self.weights[idx], axis=1)
+            cumul /= cumul[:, -1:]
+        self._sorted.update({l: values[k] for k, l in enumerate(missing)})
+        self._cumul.update({l: cumul[k] for k, l in enumerate(missing)})
 
     def build_cdf(self, label: str) -> np.array :
         """Build the cumulative distribution function.
@@ -47,8 +84,8 @@ class SampledPosterior:
             Array of the sorted values (column 0) and the cumulative function
                 (column 1).
         """
-        return np.array([self.sample.sort_values(label)[label].values, 
-            (np.arange(len(self.sample)) + 1) / len(self.sample)])
+        self._sort_columns([label])
+        return np.array([self._sorted[label], self._cumul[label]])
 
     def find_limits(self, label: str, limit: list) -> np.array :
         """Determine the parameter values based on a given probability.
@@ -60,24 +97,92 @@ class SampledPosterior:
         Return:
             Array of the corresponding values of the parameter.
         """
-        ci = np.array([])
-        for l in limit:
-            cdf = self.cdf[label]
-            fintp = interp1d(cdf[0], cdf[1] - l, kind='linear')
-            ci = np.append(ci, scipy.optimize.brentq(fintp, np.min(cdf[0]), 
-                np.max(cdf[0])))
+        return self.quantiles(limit, [label])[label]
+
+    def quantiles(self, limit: list, labels: list = None) -> dict :
+        """Determine the parameter values of several labels at once.
+
+        The value of each probability is interpolated linearly in the
+        cumulative function, as the root of the linear interpolation of
+        (cdf - probability). The positions of the probabilities in the
+        cumulative function are found with a binary search, once for all the
+        labels sharing the same cumulative function (e.g., if the sample is
+        not weighted).
+
+        Args:
+            limit: list of probability values.
+            labels: list of the columns used (default: all requested labels).
+
+        Return:
+            Dictionary with, for each label, the array of the corresponding
+                values of the parameter.
+        """
+        if labels is None:
+            labels = self.request
+        self._sort_columns(labels)
+        limit = np.asarray(limit, dtype=float)
+        ci = dict()
+        cumul = None
+        for l in labels:
+            if not self._cumul[l] is cumul:
+                cumul = self._cumul[l]
+                k, frac = _interp_index(cumul, limit)
+            x = self._sorted[l]
+            ci.update({l: x[k - 1] + frac * (x[k] - x[k - 1])})
         return ci
 
-    def get2dcontours(self, cdf_levels=None, weights=None, **bins_opts):
+    def get2dcontours(self, cdf_levels=None, weights=None, threads=None,
+            smooth=None, **bins_opts):
+        """Compute the 2D histograms and contour levels of all the pairs.
+
+        Each column is binned only once for each number of bins, with the
+        same edges as :func:`numpy.histogram2d`. The histogram of each pair
+        is then a single count of combined bin indices, and the pairs are
+        computed in a pool of threads.
+
+        Args:
+            cdf_levels: probabilities enclosed by the contours.
+            weights: weights of the sample (default: weights of the object).
+            threads: number of threads (default: as
+                :class:`concurrent.futures.ThreadPoolExecutor`).
+            smooth: standard deviation (in number of bins, one value or one
+                per axis) of a Gaussian smoothing of the histograms.
+            bins_opts: number of bins [nx, ny] of some pairs, e.g.
+                tE=[40, 60] for the pair (t, E).
+
+        Return:
+            Tuple of four N x N lists with, for i > j, the bin centers along
+                x and y, the histogram and the contour levels of the pair
+                (labels[j], labels[i]), as in
+                :func:`moana.corner.compute_2dcontours`.
+        """
+        if weights is None:
+            weights = self.weights
 
         labels = self.request
         samples = self.sample
         N = len(labels)
-
-        bins = dict()
-        [bins.update({a+b: [50, 50]}) for a in labels for b in labels]
-        [bins.update({b+a: [50, 50]}) for a in labels for b in labels]
-        bins.update(bins_opts)
+        bins = self._bins(bins_opts)
+        pairs = [(i, j) for i in range(N) for j in range(N) if j < i]
+
+        # Bin each column once for each number of bins
+        binned = dict()
+        for i, j in pairs:
+            nx, ny = bins[labels[j]+labels[i]]
+            for l, n in [(labels[j], nx), (labels[i], ny)]:
+                if not (l, n) in binned:
+                    binned.update({(l, n): _bin_column(samples[l].values, n)})
+
+        def pair(i, j):
+            nx, ny = bins[labels[j]+labels[i]]
+            xedges, ix = binned[(labels[j], nx)]
+            yedges, iy = binned[(labels[i], ny)]
+            h = np.bincount(ix * ny + iy, weights=weights, minlength=nx * ny)
+            return moana.corner.histogram_2dcontours(h.reshape(nx, ny),
+                xedges, yedges, cdf_levels=cdf_levels, smooth=smooth)
+
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            results = dict(zip(pairs, pool.map(lambda a: pair(*a), pairs)))
 
         xhist = [[None] * N for a in [None] * N]
         yhist = [[None] * N for a in [None] * N]
@@ -87,15 +192,7 @@ class SampledPosterior:
         for i in range(N):
             for j in range(N):
                 if j < i:
-                    x = samples[labels[j]].values
-                    y = samples[labels[i]].values
-                    a, b, c, d = moana.corner.compute_2dcontours(
-                        x,
-                        y,
-                        bins=[bins[labels[j]+labels[i]][0], bins[labels[j]+labels[i]][1]],
-                        cdf_levels=cdf_levels, 
-                        weights=weights
-                        )
+                    a, b, c, d = results[(i, j)]
                     xhist[i][j] = a
                     yhist[i][j] = b
                     hist[i][j] = c
@@ -103,6 +200,15 @@ class SampledPosterior:
 
         return xhist, yhist, hist, hist_levels
 
+    def _bins(self, bins_opts: dict) -> dict :
+        """Numbers of bins of the 2D histograms of each pair of labels."""
+        labels = self.request
+        bins = dict()
+        [bins.update({a+b: [50, 50]}) for a in labels for b in labels]
+        [bins.update({b+a: [50, 50]}) for a in labels for b in labels]
+        bins.update(bins_opts)
+        return bins
+
     def _get_plot_config_scatter_plots(self, rcfile=None, rotation=0, rcparams=dict()):
         """Default plot configuration for scatter plots."""
         try:
@@ -207,6 +313,7 @@ class SampledPosterior:
         weights = None,
         rotation = 0,
         display_1sigma = False,
+        smooth = None,
         rcfile = None,
         rcparams = dict()
         ):
@@ -226,7 +333,7 @@ class SampledPosterior:
 
         # Compute credible intervals
         xhist, yhist, hist, hist_levels = self.get2dcontours(
-            cdf_levels=cdf_levels, weights=weights, **bins)
+            cdf_levels=cdf_levels, weights=weights, smooth=smooth, **bins)
 
         # How label are displayed
         label_names = dict()
@@ -411,11 +518,214 @@ class SampledPosterior:
         else:
             return fig, ax
 
+class StreamedPosterior(SampledPosterior):
+    """Class to derive statistical properties from a sample read by chunks.
+
+    The sample is never loaded in memory at once. Fixed-bin histograms of
+    each label, and 2D histograms of each pair of labels, are accumulated
+    chunk by chunk; the histograms of different chunks are merged by
+    addition. The cumulative functions, the credible intervals and the 2D
+    contours are then derived from these histograms, so that the precision
+    of the credible intervals is the bin size.
+
+    If the range of a label is not given, it is computed by a first reading
+    of the chunks, so the source must then be readable twice.
+
+    Args:
+        source: path of a CSV file, of a .npy file (read as a memmap), or of
+            a Parquet file (requires pyarrow), or an iterable of
+            :obj:`pandas.DataFrame` chunks.
+        labels: labels of columns to include in statistics.
+        limit: list of probability values of the credible intervals.
+        weights: label of the column of the weights.
+        names: labels of the columns of a .npy file of 2D array.
+        chunksize: number of rows read at once.
+        nbins: number of bins of the histogram of each label.
+        ranges: dict of (min, max) of some labels.
+        bins: dict of the number of bins of the 2D histograms, given as in
+            :meth:`SampledPosterior.get2dcontours`.
+        read_options: options of :func:`pandas.read_csv`.
+
+    Attributes:
+        sample: empty :obj:`pandas.DataFrame` with the requested labels.
+        nsamples: number of rows read.
+        hist: dict and for each label, hist[label] is a tuple with the edges
+            and the histogram of the label.
+        hist2d: dict and for each pair of labels a+b, hist2d[a+b] is a tuple
+            with the edges along a, the edges along b, and the 2D histogram.
+        cdf: as in :class:`SampledPosterior`, with the edges of the bins in
+            cdf[label][0].
+        ci: as in :class:`SampledPosterior`.
+    """
+    def __init__(self, source, labels: list, limit=None, weights: str = None,
+            names: list = None, chunksize: int = 10**6, nbins: int = 10**4,
+            ranges: dict = None, bins: dict = dict(), read_options: dict = dict()):
+        self.request = labels
+        self.sample = pd.DataFrame(columns=labels)
+        self.weights = None
 
+        if limit == None:
+            self.limit = [0.1585, 0.5, 0.8415]
+        else:
+            self.limit = limit
 
+        if (weights is not None) and (not isinstance(weights, str)):
+            sys.exit("Argument error: weights must be the label of a column.")
+
+        columns = list(labels) + ([weights] if weights is not None else [])
+        chunks = lambda: _read_chunks(source, columns, chunksize, names,
+                                      read_options)
+
+        # Ranges of the histograms, with a first reading if needed
+        ranges = dict() if ranges is None else dict(ranges)
+        missing = [l for l in labels if not l in ranges]
+        if len(missing) > 0:
+            if iter(source) is source:
+                sys.exit("Argument error: the ranges must be given when the"
+                         " chunks can only be read once.")
+            lower = np.full(len(missing), np.inf)
+            upper = np.full(len(missing), -np.inf)
+            for chunk in chunks():
+                x = chunk[missing].to_numpy(dtype=float)
+                if x.shape[0] > 0:
+                    lower = np.fmin(lower, np.nanmin(x, axis=0))
+                    upper = np.fmax(upper, np.nanmax(x, axis=0))
+            ranges.update({l: (lower[k], upper[k]) for k, l in enumerate(missing)})
+
+        # Accumulate the histograms
+        pairs = [(labels[j], labels[i]) for i in range(len(labels))
+                 for j in range(i)]
+        bins = self._bins(bins)
+        self.hist = {l: (np.linspace(*ranges[l], nbins + 1), np.zeros(nbins))
+                     for l in labels}
+        self.hist2d = {a+b: (np.linspace(*ranges[a], bins[a+b][0] + 1),
+                             np.linspace(*ranges[b], bins[a+b][1] + 1),
+                             np.zeros(bins[a+b][0] * bins[a+b][1]))
+                       for a, b in pairs}
+        self.nsamples = 0
+        for chunk in chunks():
+            self.nsamples += len(chunk)
+            w = None if weights is None else chunk[weights].to_numpy(dtype=float)
+            x = {l: chunk[l].to_numpy(dtype=float) for l in labels}
+            for l in labels:
+                idx = _bin_index(x[l], self.hist[l][0])
+                ok = idx >= 0
+                self.hist[l][1][:] += np.bincount(idx[ok], minlength=nbins,
+                    weights=None if w is None else w[ok])
+            for a, b in pairs:
+                nx, ny = bins[a+b]
+                ix = _bin_index(x[a], self.hist2d[a+b][0])
+                iy = _bin_index(x[b], self.hist2d[a+b][1])
+                ok = (ix >= 0) & (iy >= 0)
+                self.hist2d[a+b][2][:] += np.bincount(ix[ok] * ny + iy[ok],
+                    minlength=nx * ny, weights=None if w is None else w[ok])
+        self.hist2d = {key: (a, b, h.reshape(len(a) - 1, len(b) - 1))
+                       for key, (a, b, h) in self.hist2d.items()}
+
+        # Cumulative functions at the edges of the bins
+        self._sorted = {l: self.hist[l][0] for l in labels}
+        self._cumul = dict()
+        for l in labels:
+            cumul = np.concatenate([[0.0], np.cumsum(self.hist[l][1])])
+            self._cumul.update({l: cumul / cumul[-1]})
 
+        self.cdf = dict()
+        for l in self.request:
+            self.cdf.update({l: self.build_cdf(l)})
+        self.ci = self.quantiles(self.limit, self.request)
 
+    def get2dcontours(self, cdf_levels=None, weights=None, threads=None,
+            smooth=None, **bins_opts):
+        """2D contours from the accumulated histograms.
 
+        The weights and the bins are those given at initialization, so that
+        weights, threads and bins_opts are ignored.
+        """
+        labels = self.request
+        N = len(labels)
+        xhist = [[None] * N for a in [None] * N]
+        yhist = [[None] * N for a in [None] * N]
+        hist = [[None] * N for a in [None] * N]
+        hist_levels = [[None] * N for a in [None] * N]
+
+        for i in range(N):
+            for j in range(N):
+                if j < i:
+                    xedges, yedges, h = self.hist2d[labels[j]+labels[i]]
+                    a, b, c, d = moana.corner.histogram_2dcontours(
+                        h, xedges, yedges, cdf_levels=cdf_levels, smooth=smooth)
+                    xhist[i][j] = a
+                    yhist[i][j] = b
+                    hist[i][j] = c
+                    hist_levels[i][j] = d
+
+        return xhist, yhist, hist, hist_levels
 
+def _read_chunks(source, columns: list, chunksize: int, names: list = None,
+        read_options: dict = dict()):
+    """Iterate over the chunks of a sample, as :obj:`pandas.DataFrame`."""
+    if not isinstance(source, str):
+        for chunk in source:
+            yield chunk[columns]
+        return
+
+    extension = os.path.splitext(source)[1].lower()
+    if extension == '.npy':
+        values = np.load(source, mmap_mode='r')
+        for i in range(0, values.shape[0], chunksize):
+            chunk = np.asarray(values[i:i + chunksize])
+            if values.dtype.names is None:
+                chunk = pd.DataFrame(chunk, columns=names)
+            else:
+                chunk = pd.DataFrame.from_records(chunk)
+            yield chunk[columns]
+    elif extension in ['.parquet', '.pq']:
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(source)
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(source, chunksize=chunksize, **read_options):
+            yield chunk[columns]
+
+def _bin_column(x: np.array, nbins: int) -> tuple :
+    """Regular bins over the range of a column, and the bin of each value.
+
+    Return:
+        Tuple with the edges and the bin indices, as numpy.histogram2d.
+    """
+    lower, upper = np.min(x), np.max(x)
+    if not (np.isfinite(lower) & np.isfinite(upper)):
+        raise ValueError(
+            "It looks like at least one of your sample columns "
+            "have no dynamic range. You could try using the "
+            "'range' argument."
+        )
+    if lower == upper:
+        lower, upper = lower - 0.5, upper + 0.5
+    edges = np.linspace(lower, upper, nbins + 1)
+    return edges, _bin_index(x, edges)
+
+def _bin_index(x: np.array, edges: np.array) -> np.array :
+    """Bin of each value, as in numpy.histogramdd, or -1 if out of the bins."""
+    idx = np.searchsorted(edges, x, side='right') - 1
+    idx[x == edges[-1]] -= 1
+    idx[idx >= len(edges) - 1] = -1
+    return idx
+
+def _interp_index(cdf: np.array, limit: np.array) -> tuple :
+    """Interval and fraction of each probability in a cumulative function.
 
+    Args:
+        cdf: increasing cumulative function (length > 1).
+        limit: array of probability values.
 
+    Return:
+        Tuple with the indices k such that cdf[k-1] < limit <= cdf[k], and
+            the position of limit between cdf[k-1] and cdf[k], in [0, 1].
+    """
+    k = np.clip(np.searchsorted(cdf, limit, side='left'), 1, len(cdf) - 1)
+    step = cdf[k] - cdf[k - 1]
+    frac = np.divide(limit - cdf[k - 1], step, out=np.zeros(k.shape),
+                     where=step > 0)
+    return k, np.clip(frac, 0, 1)
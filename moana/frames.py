@@ -1,7 +1,7 @@
 from __future__ import annotations
 
+import functools
 import numpy as np
-import pandas as pd
 import sys
 try:
     from typing import Literal
@@ -50,6 +50,18 @@ class LensReferenceFrame:
             txt = "Argument error: [x_axis = '12' | '21']."
             sys.exit(txt)
 
+    def transform(self, new_frame: LensReferenceFrame) -> FrameTransform:
+        """Transform from this reference frame to a new one.
+
+        Args:
+            new_frame: new reference frame.
+
+        Returns:
+            The :class:`FrameTransform`, cached for each pair of frames.
+        """
+        return _frame_transform(self._center, self._x_axis, new_frame.center,
+                                new_frame.x_axis)
+
     def to_frame(self, z: np.ndarray, new_frame: LensReferenceFrame, **kwargs):
         """Compute positions in a new reference frame.
 
@@ -61,46 +73,112 @@ class LensReferenceFrame:
             sep (float): separation in Einstein units.
             gl1 (float): distance from the barycenter to the primary, in Einstein
                 units
+            out (np.ndarray): complex array where the result is stored (e.g.,
+                z itself, to move positions in place).
+
+        The separation and gl1 may be arrays, broadcast against z.
 
         """
-        z_new = pd.DataFrame()
-        z_new['before'] = z
-        z_new['after'] = z
-        
-        sep = kwargs['sep']
-        gl1 = kwargs['gl1']
-        x_offset = 0
-
-        if not self._center == new_frame.center:
-            if self._center == 'primary':
-                if new_frame.center == 'secondary':
-                    x_offset = sep
-                if new_frame.center == 'barycenter':
-                    x_offset = np.abs(gl1)
-
-            if self._center == 'secondary':
-                if (new_frame.center == 'primary'):
-                    x_offset = - sep
-                if (new_frame.center == 'barycenter'):
-                    x_offset = - sep + np.abs(gl1)
-
-            if self._center == 'barycenter':
-                if (new_frame.center == 'primary'):
-                    x_offset = - np.abs(gl1)
-                if (new_frame.center == 'secondary'):
-                    x_offset = sep - np.abs(gl1)
-        
-        if self._x_axis == new_frame.x_axis:
-            if self._x_axis == '12':
-                z_new['after'] = z_new['after'] - x_offset
-            if self._x_axis == '21':
-                z_new['after'] = z_new['after'] + x_offset
-
-        else:
-            z_new['after'] = - z_new['after'].values.conjugate()
-            if self._x_axis == '12':
-                z_new['after'] = z_new['after'] + x_offset
-
-            if self._x_axis == '21':
-                z_new['after'] = z_new['after'] - x_offset
-        return z_new['after'].values
+        return self.transform(new_frame)(z, kwargs['sep'], kwargs['gl1'],
+                                         out=kwargs.get('out'))
+
+
+class FrameTransform:
+    """Complex affine transform between two lens reference frames.
+
+    The transform maps z to sign * conj(z) + a * sep + b * |gl1| if conj is
+    True, and to sign * z + a * sep + b * |gl1| otherwise.
+
+    Args:
+        conj: if True, conjugate the positions.
+        sign: +1 or -1.
+        a: coefficient of the separation in the shift.
+        b: coefficient of |gl1| in the shift.
+
+    """
+
+    def __init__(self, conj: bool = False, sign: int = 1, a: int = 0, b: int = 0):
+
+        self.conj = conj
+        self.sign = sign
+        self.a = a
+        self.b = b
+
+    def __repr__(self):
+        return (f'FrameTransform(conj={self.conj}, sign={self.sign}, '
+                f'a={self.a}, b={self.b})')
+
+    def _key(self):
+        return (self.conj, self.sign, self.a, self.b)
+
+    def __eq__(self, other):
+        if not isinstance(other, FrameTransform):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def then(self, other: FrameTransform) -> FrameTransform:
+        """Transform applying this transform, then the other one."""
+        return FrameTransform(conj=self.conj ^ other.conj,
+                              sign=self.sign * other.sign,
+                              a=other.sign * self.a + other.a,
+                              b=other.sign * self.b + other.b)
+
+    def inverse(self) -> FrameTransform:
+        """Inverse transform."""
+        return FrameTransform(conj=self.conj, sign=self.sign,
+                              a=- self.sign * self.a, b=- self.sign * self.b)
+
+    def __call__(self, z: np.ndarray, sep: np.ndarray, gl1: np.ndarray,
+            out: np.ndarray = None) -> np.ndarray:
+        """Apply the transform.
+
+        Args:
+            z: array of any shape of positions.
+            sep: separation in Einstein units, broadcast against z.
+            gl1: distance from the barycenter to the primary, in Einstein
+                units, broadcast against z.
+            out: complex array where the result is stored, with the shape
+                of the broadcast z, sep and gl1; it may be z.
+
+        Returns:
+            Array of the positions in the new frame, with the shape of the
+                broadcast z, sep and gl1.
+        """
+        if out is None:
+            out = np.empty(np.broadcast_shapes(np.shape(z), np.shape(sep),
+                np.shape(gl1)), dtype=complex)
+            out[...] = z
+        elif out is not z:
+            out[...] = z
+        if self.conj:
+            np.conjugate(out, out=out)
+        if self.sign < 0:
+            np.negative(out, out=out)
+        if not self.a == 0:
+            out += self.a * np.asarray(sep)
+        if not self.b == 0:
+            out += self.b * np.abs(gl1)
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def _frame_transform(center, x_axis, new_center, new_x_axis):
+    """Compile the transform between two frames."""
+    offsets = {('primary', 'secondary'): (1, 0),
+               ('primary', 'barycenter'): (0, 1),
+               ('secondary', 'primary'): (-1, 0),
+               ('secondary', 'barycenter'): (-1, 1),
+               ('barycenter', 'primary'): (0, -1),
+               ('barycenter', 'secondary'): (1, -1)}
+    a, b = offsets.get((center, new_center), (0, 0))
+
+    if x_axis == new_x_axis:
+        if x_axis == '12':
+            return FrameTransform(a=-a, b=-b)
+        return FrameTransform(a=a, b=b)
+    if x_axis == '12':
+        return FrameTransform(conj=True, sign=-1, a=a, b=b)
+    return FrameTransform(conj=True, sign=-1, a=-a, b=-b)
@@ -0,0 +1,199 @@
+import concurrent.futures
+from moana.dbc.model import chi2 as model_chi2
+from moana.lookup import ModelsSummary
+from moana.utils import save_npz_atomic
+import numpy as np
+import os
+import pandas as pd
+import sys
+from typing import Callable, Optional
+
+class ModelChi2:
+    """Chi^2 of binary-lens models as a function of (s, q, alpha).
+
+    The other parameters are those of a reference model. The instances can be
+    sent to other processes, as required by :class:`GridSearch`.
+
+    Args:
+        param: reference model parameters, e.g. :obj:`moana.dbc.Output.param`.
+        dataset: a :obj:`moana.dbc.Dataset`.
+        tol: relative precision of the finite-source magnification.
+
+    """
+    def __init__(self, param: pd.Series, dataset, tol: float = 1e-3):
+        self.param = param
+        self.dataset = dataset
+        self.tol = tol
+        if getattr(dataset, 'photometry', None) is None:
+            dataset.load_photometry()
+
+    def __call__(self, sep: np.ndarray, q: np.ndarray,
+            alpha: np.ndarray) -> np.ndarray:
+        table = pd.DataFrame([self.param] * len(sep)).reset_index(drop=True)
+        table['sep'] = sep
+        table['eps1'] = q / (1.0 + q)
+        table['alpha'] = alpha
+        return model_chi2(table, self.dataset, tol=self.tol)['chi2']
+
+
+class GridSearch:
+    """Coarse-to-fine grid search in (s, q, alpha).
+
+    A regular grid in (log10 s, log10 q, alpha) is first evaluated. At each
+    of the next levels, the step is divided by refine, and the neighbours of
+    the nkeep best models of all the previous levels are evaluated, if they
+    are not already known. The models are evaluated by chunks in a pool of
+    processes. If checkpoint is given, each chunk is saved in this directory
+    as soon as it is completed, so that an interrupted search resumes with
+    the missing chunks only.
+
+    Args:
+        fcn: function of arrays (sep, q, alpha) returning the chi^2 of each
+            model, e.g. a :class:`ModelChi2`. It must be picklable.
+        sep: range (min, max) of the separation.
+        q: range (min, max) of the mass ratio.
+        alpha: range (min, max) of alpha, in radians.
+        shape: number of points of the first grid along each axis.
+        nkeep: number of best models refined at each level.
+        nlevels: number of levels, including the first grid.
+        refine: factor by which the step is divided at each level.
+        chunk: number of models per chunk.
+        processes: number of processes (default: number of CPUs).
+        checkpoint: directory where the chunks are saved.
+
+    Attributes:
+        models: :obj:`pandas.DataFrame` of all the models evaluated, with
+            columns sep, q, alpha, chi2 and level.
+
+    """
+    def __init__(self,
+            fcn: Callable,
+            sep: tuple = (0.3, 3.0),
+            q: tuple = (1e-5, 1e-1),
+            alpha: tuple = (0.0, 2 * np.pi),
+            shape: tuple = (10, 10, 12),
+            nkeep: int = 10,
+            nlevels: int = 3,
+            refine: int = 3,
+            chunk: int = 16,
+            processes: Optional[int] = None,
+            checkpoint: Optional[str] = None):
+
+        self.fcn = fcn
+        self.lower = np.array([np.log10(sep[0]), np.log10(q[0]), alpha[0]])
+        self.upper = np.array([np.log10(sep[1]), np.log10(q[1]), alpha[1]])
+        self.shape = np.array(shape)
+        self.nkeep = nkeep
+        self.nlevels = nlevels
+        self.refine = refine
+        self.chunk = chunk
+        self.processes = processes
+        self.checkpoint = checkpoint
+        self.periodic = np.isclose(alpha[1] - alpha[0], 2 * np.pi)
+
+        # The grid of a periodic alpha does not repeat its last point
+        if (np.any(self.shape[:2] < 2) or (self.shape[2] < 1)
+                or ((self.shape[2] < 2) and not self.periodic)):
+            sys.exit("Argument error: the first grid needs 2 points per axis"
+                     " (1 for a periodic alpha).")
+
+        # Step of the first grid, and integer coordinates on the finest grid
+        npts = self.shape - np.array([1, 1, 0 if self.periodic else 1])
+        self.step = (self.upper - self.lower) / npts
+        self.finest = self.step / self.refine**(self.nlevels - 1)
+        self.models = pd.DataFrame(columns=['sep', 'q', 'alpha', 'chi2', 'level'])
+
+    def _to_physical(self, idx):
+        x = self.lower + idx * self.finest
+        return 10**x[:, 0], 10**x[:, 1], x[:, 2]
+
+    def _first_grid(self):
+        factor = self.refine**(self.nlevels - 1)
+        axes = [np.arange(n) * factor for n in self.shape]
+        idx = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+        return idx.reshape(-1, 3)
+
+    def _neighbours(self, best, level):
+        """Points of a level around the best models, inside the ranges."""
+        factor = self.refine**(self.nlevels - 1 - level)
+        k = np.arange(-self.refine, self.refine + 1) * factor
+        offsets = np.stack(np.meshgrid(k, k, k, indexing='ij'), axis=-1)
+        idx = (best[:, None, :] + offsets.reshape(1, -1, 3)).reshape(-1, 3)
+        nmax = np.round((self.upper - self.lower) / self.finest).astype(int)
+        if self.periodic:
+            idx[:, 2] = np.mod(idx[:, 2], nmax[2])
+        inside = np.all((idx >= 0) & (idx <= nmax), axis=1)
+        return np.unique(idx[inside], axis=0)
+
+    def run(self) -> ModelsSummary:
+        """Run (or resume) the search.
+
+        Returns:
+            A :class:`moana.lookup.ModelsSummary` whose table describe
+                contains all the models, sorted by chi^2.
+        """
+        if self.checkpoint is not None:
+            os.makedirs(self.checkpoint, exist_ok=True)
+
+        known = np.empty((0, 3), dtype=int)
+        chi2 = np.empty(0)
+        levels = np.empty(0, dtype=int)
+        for level in range(self.nlevels):
+            if level == 0:
+                idx = self._first_grid()
+            else:
+                best = known[np.argsort(chi2, kind='stable')[:self.nkeep]]
+                idx = self._neighbours(best, level)
+            # Only the new points
+            seen = set(map(tuple, known.tolist()))
+            idx = idx[[not a in seen for a in map(tuple, idx.tolist())]]
+            if idx.shape[0] == 0:
+                continue
+            idx_level, chi2_level = self._evaluate(idx, level)
+            known = np.concatenate([known, idx_level])
+            chi2 = np.concatenate([chi2, chi2_level])
+            levels = np.concatenate([levels, np.full(idx_level.shape[0], level)])
+
+        sep, q, alpha = self._to_physical(known)
+        self.models = pd.DataFrame({'sep': sep, 'q': q, 'alpha': alpha,
+            'chi2': chi2, 'level': levels}).sort_values('chi2', kind='stable')\
+            .reset_index(drop=True)
+
+        summary = ModelsSummary()
+        summary.describe = self.models.assign(file=[
+            f'grid_level{a}' for a in self.models['level']])
+        return summary
+
+    def _evaluate(self, idx, level):
+        """Evaluate the models of a level by chunks, in parallel."""
+        starts = range(0, idx.shape[0], self.chunk)
+        results = dict()
+        todo = []
+        for k, i in enumerate(starts):
+            fname = self._chunk_name(level, k)
+            if (fname is not None) and os.path.isfile(fname):
+                x = np.load(fname)
+                if np.array_equal(x['idx'], idx[i:i + self.chunk]):
+                    results[k] = x['chi2']
+                    continue
+            todo.append((k, i))
+
+        if len(todo) > 0:
+            with concurrent.futures.ProcessPoolExecutor(self.processes) as pool:
+                jobs = {pool.submit(self.fcn, *self._to_physical(
+                    idx[i:i + self.chunk])): (k, i) for k, i in todo}
+                for job in concurrent.futures.as_completed(jobs):
+                    k, i = jobs[job]
+                    results[k] = np.asarray(job.result(), dtype=float)
+                    fname = self._chunk_name(level, k)
+                    if fname is not None:
+                        save_npz_atomic(fname, idx=idx[i:i + self.chunk],
+                                        chi2=results[k])
+
+        chi2 = np.concatenate([results[k] for k in range(len(starts))])
+        return idx, chi2
+
+    def _chunk_name(self, level, k):
+        if self.checkpoint is None:
+            return None
+        return os.path.join(self.checkpoint, f'level{level}_chunk{k:06d}.npz')
@@ -1,11 +1,17 @@
 #import concave_hull
-import copy
 from .frames import LensReferenceFrame
+from .utils import save_npz_atomic
+import collections
+import concurrent.futures
+import hashlib
 import math
 import numpy as np
+import os
 import pandas as pd
 import sys
+import threading
 from typing import Optional
+import warnings
 
 
 class Microlens:
@@ -18,6 +24,7 @@ class Microlens:
     Keyword arguments:
 	s (float): alias for sep.
 	eps1 (float): planet-to-host star mass fraction. 
+	ntot (int): number of points of the caustic.
 
     """
 
@@ -38,8 +45,8 @@ class Microlens:
 
         if frame == None:
             frame = LensReferenceFrame()
-
-        #self.caustic = Caustic(self)
+        self.frame = frame
+        self.ntot = kwargs.get('ntot', 200)
 
     @property
     def la(self):
@@ -64,12 +71,31 @@ class Microlens:
         self._gl1 = - self.sep * self.q / (1.0 + self.q)
         self._gl2 = self.sep / (1.0 + self.q)
 
-#    def sample_caustic(self, output=False, *args, **kwargs):
-#        if not 'frame' in kwargs:
-#            frame = kwargs.update({'frame': LensReferenceFrame(center='barycenter', x_axis='12')})
-#        self.caustic.sample(*args, **kwargs)
-#        if output:
-#            return self.caustic.edge
+    @property
+    def caustic(self):
+        """Sampled caustic, computed on first access and memoized.
+
+        The caustic is shared with all the lenses with the same (quantized)
+        parameters through :obj:`caustic_cache`.
+        """
+        return caustic_cache.get(self.sep, self.q, self.ntot, self.frame)
+
+    def sample_caustic(self, ntot: Optional[int] = None,
+            frame: Optional[LensReferenceFrame] = None, output: bool = False):
+        """Sample the caustic.
+
+        Args:
+            ntot: number of points (default: the ntot attribute).
+            frame: reference frame of the caustic (default: the lens frame).
+            output: if True, return the caustic points.
+        """
+        if ntot is not None:
+            self.ntot = ntot
+        if frame is not None:
+            self.frame = frame
+        if output:
+            return self.caustic.edge
+        self.caustic
 
 
 class ResonantCaustic:
@@ -97,192 +123,744 @@ class ResonantCaustic:
         self.edge = None
         self._ntot = 50
 
-    def _sample(self, ntot, uniform=False):
+    def diagnostics(self) -> pd.DataFrame:
+        """Table of the sampling diagnostics of the last call to _sample.
+
+        The caustic is sampled again with the same arguments, without the
+        compact mode. The table is the attribute sampling, with the critical
+        points, their images, the Taylor predictions and the flags used to
+        follow the branches; it is only available if uniform is False.
+        """
+        other = ResonantCaustic(sep=self.sep, q=self.q)
+        other._sample(**self._sample_args)
+        return getattr(other, 'sampling', None)
+
+    def _critical_derivatives(self, phi: np.ndarray):
+        """Source-plane derivatives of the caustic at given angles.
+
+        Args:
+            phi: array of the angle parameter.
+
+        Returns:
+            Tuple with the sum over the four critical points of |dzeta/dphi|,
+                and the maximum over the four critical points of
+                |d2zeta/dphi2|.
+        """
+        z = critic_2l(self.sep, self.q, phi)
+        d1, d2 = get_dzeta_phi(self.sep, self.q, z)
+        return np.sum(np.abs(d1), axis=1), np.max(np.abs(d2), axis=1)
+
+    def _curvilinear_length(self, tol: float = 1e-4, ninit: int = 64,
+            max_iter: int = 30) -> np.ndarray:
+        """Adaptive sampling of the angle parameter and curvilinear abscissa.
+
+        Starting from a uniform grid in phi, each interval is split in two until
+        the distance between the caustic and its chords, estimated from the
+        second derivative as |d2zeta/dphi2| dphi^2 / 8, is smaller than tol.
+        Only the new points are solved at each iteration.
+
+        Args:
+            tol: tolerance in the source plane, in Einstein units.
+            ninit: number of intervals of the initial grid.
+            max_iter: maximum number of refinement iterations.
+
+        Returns:
+            Array with the angles in [0, 2*pi] (row 0) and the corresponding
+                normalized curvilinear abscissa (row 1).
+        """
+        phi = np.linspace(0, 2 * np.pi, ninit + 1)
+        speed, curv = self._critical_derivatives(phi)
+        for _ in range(max_iter):
+            dphi = np.diff(phi)
+            err = np.maximum(curv[:-1], curv[1:]) * dphi**2 / 8
+            split = err > tol
+            if not np.any(split):
+                break
+            mid = phi[:-1][split] + 0.5 * dphi[split]
+            speed_mid, curv_mid = self._critical_derivatives(mid)
+            phi = np.concatenate([phi, mid])
+            speed = np.concatenate([speed, speed_mid])
+            curv = np.concatenate([curv, curv_mid])
+            order = np.argsort(phi)
+            phi, speed, curv = phi[order], speed[order], curv[order]
+
+        s = np.concatenate([[0.0], np.cumsum(0.5 * (speed[1:] + speed[:-1])
+                                             * np.diff(phi))])
+        return np.array([phi, s / s[-1]])
+
+    def _taylor_angles(self, tol: float = 1e-4, order: int = 4,
+            ninit: int = 16, max_iter: int = 30) -> np.ndarray:
+        """Adaptive sampling of the angle parameter for Taylor predictions.
+
+        Starting from a uniform grid in phi, each interval is split in two until
+        the error of the Taylor prediction of the caustic at the given order,
+        estimated from the last term as |d^n zeta/dphi^n| dphi^n / n!, is
+        smaller than tol. The higher the order, the larger the steps.
+
+        Args:
+            tol: tolerance in the source plane, in Einstein units.
+            order: order of the Taylor expansion, from 1 to 4.
+            ninit: number of intervals of the initial grid.
+            max_iter: maximum number of refinement iterations.
+
+        Returns:
+            Array of the angles in [0, 2*pi].
+        """
+        def last_term(phi):
+            z = critic_2l(self.sep, self.q, phi)
+            dn = get_dzeta_phi(self.sep, self.q, z, order=order)[-1]
+            return np.max(np.abs(dn), axis=1) / math.factorial(order)
+
+        phi = np.linspace(0, 2 * np.pi, ninit + 1)
+        dn = last_term(phi)
+        for _ in range(max_iter):
+            dphi = np.diff(phi)
+            err = np.maximum(dn[:-1], dn[1:]) * dphi**order
+            split = err > tol
+            if not np.any(split):
+                break
+            mid = phi[:-1][split] + 0.5 * dphi[split]
+            phi = np.concatenate([phi, mid])
+            dn = np.concatenate([dn, last_term(mid)])
+            idx = np.argsort(phi)
+            phi, dn = phi[idx], dn[idx]
+        return phi
+
+    def _make_uniform(self, phi_s: np.ndarray, nb: int) -> np.ndarray:
+        """Add points uniformly distributed in curvilinear abscissa.
+
+        Args:
+            phi_s: output of :meth:`_curvilinear_length`.
+            nb: number of points uniformly distributed along the caustic.
+
+        Returns:
+            Array with the angles in [0, 2*pi[ (row 0) and the corresponding
+                normalized curvilinear abscissa (row 1).
+        """
+        phi, s = phi_s
+        phi_uniform = np.interp(np.linspace(0, 1, nb, endpoint=False), s, phi)
+        phi_new = np.union1d(phi[:-1], phi_uniform)
+        # Remove the angles that can't be distinguished once shifted by 2*pi
+        keep = np.diff(phi_new + 2 * np.pi, prepend=-np.inf) > 1e-12
+        phi_new = phi_new[keep]
+        return np.array([phi_new, np.interp(phi_new, phi, s)])
+
+    def _sample(self, ntot, uniform=False, tol=1e-4, continuation=True,
+            order=2, compact=False, dtype=np.complex128):
+        """Sample the caustic.
+
+        Args:
+            ntot: number of angles if uniform is False and order is 2.
+                If uniform is True, ntot/2 points are uniformly distributed in
+                curvilinear abscissa, and more points are added where the
+                caustic is strongly curved.
+            uniform: if True, sample the angle parameter adaptively.
+            tol: if uniform is True, tolerance in the source plane on the
+                distance between the caustic and the sampled polyline. If
+                uniform is False and order is larger than 2, tolerance on the
+                Taylor predictions, see :meth:`_taylor_angles`.
+            continuation: if True, follow the critical points from one angle
+                to the next with :func:`track_critic_2l`, and use their
+                identity instead of the Taylor predictions to connect the
+                branches. If False, the branches are connected with flags on
+                the directions of the tangents, which may jump from one
+                branch to the other close to the cusps; it is only used if
+                uniform is False and order is 2.
+            order: order of the Taylor predictions of the caustic, from 2
+                to 4. If larger than 2 and uniform is False, the angles are
+                chosen with :meth:`_taylor_angles`, and continuation is
+                forced since their large steps defeat the flags.
+            compact: if True, only store the ordered caustic polyline in the
+                contiguous array zeta, and the angles in phi; the tables b1,
+                b2, full and sampling are not built (see :meth:`diagnostics`).
+            dtype: type of zeta if compact is True (complex128 or complex64);
+                phi has the real type of the same precision.
+        """
+        self._sample_args = {'ntot': ntot, 'uniform': uniform, 'tol': tol,
+                             'continuation': continuation, 'order': order}
 
         nb = int(0.5 * ntot)
         if uniform:
-            phi_s = self._curvilinear_length()
+            phi_s = self._curvilinear_length(tol=tol)
             uniform_phi_s = self._make_uniform(phi_s, nb)
             self.phi_s = phi_s
             self.uniform_phi_s = uniform_phi_s
             phi = uniform_phi_s[0]
+            # The flags can't connect the branches across the uneven steps
+            continuation = True
+        elif order > 2:
+            phi = self._taylor_angles(tol=tol, order=order)[:-1]
+            # The steps are too large for the angles of the predictions to
+            # tell the branches apart: follow the critical points instead
+            continuation = True
         else:
             phi_min = 0
             phi_max = 2 * np.pi
             phi = np.linspace(phi_min, phi_max, ntot, endpoint=False)
         
         # Use an angle as parameter to sample the caustic
-        sampling = pd.DataFrame()
-        sampling['phi'] = phi
-        sampling['phi_for_roots'] = phi
-
-        mask = sampling['phi'] > 2*np.pi
-        sampling.loc[mask, 'phi_for_roots'] = sampling.loc[mask, 'phi'] - 2*np.pi
+        phi = np.asarray(phi, dtype=float)
+        phi_for_roots = np.where(phi > 2*np.pi, phi - 2*np.pi, phi)
         
         # Find the critical points
-        z = np.array([critic_2l(self.sep, self.q, a) for a in sampling['phi_for_roots'].values])
+        if continuation:
+            z = track_critic_2l(self.sep, self.q, phi)
+        else:
+            z = critic_2l(self.sep, self.q, phi_for_roots)
         
         # Map the critical curves from the lens to source plane
-        zz = np.array([lens_equation_2l(self.xcoords, self.eps, a) for a in z])
-
-        # Store the caustic
-        zetasp = ['zeta0', 'zeta1', 'zeta2', 'zeta3']
-        zetalp = ['z0', 'z1', 'z2', 'z3']
-        for i in range(4):
-            sampling[zetasp[i]] = zz.T[i]
-            sampling[zetalp[i]] = z.T[i]
-        
+        zz = lens_equation_2l(self.xcoords, self.eps, z)
+
         # Choose zeta2, zeta3 for Im(zz) > 0
-        for i in range(len(sampling)):
-            y = copy.copy(sampling)
-            x = y.loc[i, zetasp]
-            mask = np.argsort(x.to_numpy().imag)
-            for j in range(4):
-                sampling.loc[i, zetasp[j]] = y.loc[i, zetasp[mask[j]]]
-                sampling.loc[i, zetalp[j]] = y.loc[i, zetalp[mask[j]]]
+        mask = np.argsort(zz.imag, axis=1)
+        zz = np.take_along_axis(zz, mask, axis=1)
+        z = np.take_along_axis(z, mask, axis=1)
 
         # Find point C
-        z_C = sampling.at[0, 'zeta3']
+        z_C = zz[0, 3]
         zeo1_C = get_dzeta_phi(self.sep, self.q, z_C)
 
         # Find point A and B
-        z_A = sampling.at[0, 'zeta1']
-        z_B = sampling.at[0, 'zeta2']
+        z_A = zz[0, 1]
+        z_B = zz[0, 2]
         zeo1_A = get_dzeta_phi(self.sep, self.q, z_A)
         if z_A.real > z_B.real:
-            z_A = sampling.at[0, 'zeta2']
-            z_B = sampling.at[0, 'zeta1']
+            z_A = zz[0, 2]
+            z_B = zz[0, 1]
             zeo1_A = get_dzeta_phi(self.sep, self.q, z_A)
-            bcurr = 'zeta2'
-        else:
-            bcurr = 'zeta1'
 
         # Compute Taylor approximation
-        x = np.array([get_dzeta_phi(self.sep, self.q, zp) for zp in sampling.z2.values])
-        sampling['ze2o1'] = x.T[0]
-        sampling['ze2o2'] = x.T[1]
-        x = np.array([get_dzeta_phi(self.sep, self.q, zp) for zp in sampling.z3.values])
-        sampling['ze3o1'] = x.T[0]
-        sampling['ze3o2'] = x.T[1]
+        ze2o = get_dzeta_phi(self.sep, self.q, z[:, 2], order=max(order, 2))
+        ze3o = get_dzeta_phi(self.sep, self.q, z[:, 3], order=max(order, 2))
+        ze2o1, ze2o2 = ze2o[:2]
+        ze3o1, ze3o2 = ze3o[:2]
 
         # Prediction
-        dphi = np.roll(sampling['phi'].to_numpy(), -1) - sampling['phi'].to_numpy()
-        sampling['ze2t'] = sampling['zeta2'] + sampling['ze2o1'] * dphi\
-            + 0.5 * sampling['ze2o2'] * dphi**2
-        sampling['ze3t'] = sampling['zeta3'] + sampling['ze3o1'] * dphi\
-            + 0.5 * sampling['ze3o2'] * dphi**2
-
-        sampling['dsze2'] = np.abs(sampling['ze2o1']) * dphi
-        sampling['dsze3'] = np.abs(sampling['ze2o1']) * dphi
-
-        x = (sampling['ze2t'] - sampling['zeta2']).to_numpy()
-        sampling['dze2a'] = np.angle(x, deg=True)
-        x = (sampling['ze3t'] - sampling['zeta3']).to_numpy()
-        sampling['dze3a'] = np.angle(x, deg=True)
-
-        sampling['22'] = np.abs(back_in_pipi(
-            np.roll(sampling['dze2a'], -1) - sampling['dze2a']))
-        sampling['23'] = np.abs(back_in_pipi(
-            np.roll(sampling['dze3a'], -1) - sampling['dze2a']))
-        sampling['32'] = np.abs(back_in_pipi(
-            np.roll(sampling['dze2a'], -1) - sampling['dze3a']))
-        sampling['33'] = np.abs(back_in_pipi(np.abs(
-            np.roll(sampling['dze3a'], -1) - sampling['dze3a'])))
-
-        sampling['flag2223'] = (np.abs(sampling['22']-sampling['23']) > 20)\
-                & (np.abs(sampling['ze2o1']) > 1e-2)
-        sampling['flag3332'] = (np.abs(sampling['33']-sampling['32']) > 20)\
-                & (np.abs(sampling['ze3o1']) > 1e-2)
-        sampling['flag2232'] = (np.abs(sampling['22']-sampling['32']) > 20)\
-                & (np.abs(sampling['ze2o1']) > 1e-2)
-        sampling['flag3323'] = (np.abs(sampling['33']-sampling['23']) > 20)\
-                & (np.abs(sampling['ze3o1']) > 1e-2)
-
-        sampling['flag2to2'] = (sampling['22'] < 20) & sampling['flag2223']
-        sampling['flag2to3'] = (sampling['23'] < 20) & sampling['flag2223']
-
-        sampling['flag3to3'] = (sampling['33'] < 20) & sampling['flag3332']
-        sampling['flag3to2'] = (sampling['32'] < 20) & sampling['flag3332']
-
-        b1 = pd.DataFrame()
-        b1['zeta'] = [z_A]
-        b1['zeo1'] = [zeo1_A]
-        b1['phi'] = [0.0]
-
-        b2 = pd.DataFrame()
-        b2['zeta'] = [z_C]
-        b2['zeo1'] = [zeo1_C]
-        b2['phi'] = [2*np.pi]
+        dphi = np.roll(phi, -1) - phi
+        ze2t, ze3t = zz[:, 2], zz[:, 3]
+        for k in range(len(ze2o)):
+            factor = dphi**(k + 1) / math.factorial(k + 1)
+            ze2t = ze2t + ze2o[k] * factor
+            ze3t = ze3t + ze3o[k] * factor
+
+        dsze2 = np.abs(ze2o1) * dphi
+        dsze3 = np.abs(ze2o1) * dphi
+
+        # Directions of the tangents: the thresholds below are angles between
+        # tangents, and the curvature term of the predictions would rotate
+        # them by more than the thresholds close to the cusps
+        dze2a = np.angle(ze2o1 * dphi, deg=True)
+        dze3a = np.angle(ze3o1 * dphi, deg=True)
+
+        a22 = np.abs(back_in_pipi(np.roll(dze2a, -1) - dze2a))
+        a23 = np.abs(back_in_pipi(np.roll(dze3a, -1) - dze2a))
+        a32 = np.abs(back_in_pipi(np.roll(dze2a, -1) - dze3a))
+        a33 = np.abs(back_in_pipi(np.abs(np.roll(dze3a, -1) - dze3a)))
+
+        flag2223 = (np.abs(a22 - a23) > 20) & (np.abs(ze2o1) > 1e-2)
+        flag3332 = (np.abs(a33 - a32) > 20) & (np.abs(ze3o1) > 1e-2)
+        flag2232 = (np.abs(a22 - a32) > 20) & (np.abs(ze2o1) > 1e-2)
+        flag3323 = (np.abs(a33 - a23) > 20) & (np.abs(ze3o1) > 1e-2)
+
+        flag2to2 = (a22 < 20) & flag2223
+        flag2to3 = (a23 < 20) & flag2223
+
+        flag3to3 = (a33 < 20) & flag3332
+        flag3to2 = (a32 < 20) & flag3332
+
+        if continuation:
+            # The columns of z are continuous branches: follow them
+            label = np.roll(mask, -1, axis=0)
+            flag2to2 = mask[:, 2] == label[:, 2]
+            flag2to3 = mask[:, 2] == label[:, 3]
+            flag3to3 = mask[:, 3] == label[:, 3]
+            flag3to2 = mask[:, 3] == label[:, 2]
+
+        # Follow the branches; python lists are faster than numpy scalars here
+        zeta2, zeta3 = zz[:, 2].tolist(), zz[:, 3].tolist()
+        cols = [[flag2to2.tolist(), zeta2, flag2to3.tolist(), zeta3, ze2t.tolist()],
+                [flag3to3.tolist(), zeta3, flag3to2.tolist(), zeta2, ze3t.tolist()]]
+        n = phi.shape[0]
+        b1_zeta = np.empty(max(n - 2, 0), dtype=complex)
+        b2_zeta = np.empty(max(n - 2, 0), dtype=complex)
 
         bcurr = 1
-
-        cols = [['flag2to2', 'zeta2', 'flag2to3', 'zeta3', 'ze2t'],
-                ['flag3to3', 'zeta3', 'flag3to2', 'zeta2', 'ze3t']]
-        for i in range(len(sampling)-1):
-            if i==0: continue
-
-            b1tmp = pd.DataFrame()
-            b2tmp = pd.DataFrame()
+        for i in range(1, n - 1):
+            stay, same, switch, other, pred = cols[bcurr]
 
             # Branch CB
-            if sampling.at[i, cols[bcurr][0]]:
-                b1tmp['zeta'] = [sampling.at[i+1, cols[bcurr][3]]]
-                b2tmp['zeta'] = [sampling.at[i+1, cols[bcurr][1]]]
-                b1tmp['phi'] = [sampling.at[i+1, 'phi']]
-                b2tmp['phi'] = [sampling.at[i+1, 'phi'] + 2*np.pi]
-            elif sampling.at[i, cols[bcurr][2]]: 
-                b1tmp['zeta'] = [sampling.at[i+1, cols[bcurr][1]]]
-                b2tmp['zeta'] = [sampling.at[i+1, cols[bcurr][3]]]
-                b1tmp['phi'] = [sampling.at[i+1, 'phi']]
-                b2tmp['phi'] = [sampling.at[i+1, 'phi'] + 2*np.pi]
-                if bcurr==1: bcurr = 0
-                else: bcurr = 1
+            if stay[i]:
+                swap = False
+            elif switch[i]:
+                swap = True
             else:
-                d33 = np.abs(sampling.at[i, cols[bcurr][4]] - sampling.at[i+1, cols[bcurr][1]])
-                d32 = np.abs(sampling.at[i, cols[bcurr][4]] - sampling.at[i+1, cols[bcurr][3]])
-
-                if d33 < d32:
-                    b1tmp['zeta'] = [sampling.at[i+1, cols[bcurr][3]]]
-                    b2tmp['zeta'] = [sampling.at[i+1, cols[bcurr][1]]]
-                    b1tmp['phi'] = [sampling.at[i+1, 'phi']]
-                    b2tmp['phi'] = [sampling.at[i+1, 'phi'] + 2*np.pi]
-                else:
-                    b1tmp['zeta'] = [sampling.at[i+1, cols[bcurr][1]]]
-                    b2tmp['zeta'] = [sampling.at[i+1, cols[bcurr][3]]]
-                    b1tmp['phi'] = [sampling.at[i+1, 'phi']]
-                    b2tmp['phi'] = [sampling.at[i+1, 'phi'] + 2*np.pi]
-                    if bcurr==1: bcurr = 0
-                    else: bcurr = 1
-
-            b1 = pd.concat([b1,b1tmp], sort=False)
-            b2 = pd.concat([b2,b2tmp], sort=False)
-
-        b2tmp = pd.DataFrame()
-        if z_B.imag >= 0:
-            b2tmp['zeta'] = [z_B]
-            b2tmp['phi'] = [2*np.pi]
-        b2 = pd.concat([b2,b2tmp], sort=False)
-
-        b1.reset_index(inplace=True, drop=True)
-        b2.reset_index(inplace=True, drop=True)
+                d33 = abs(pred[i] - same[i+1])
+                d32 = abs(pred[i] - other[i+1])
+                swap = not d33 < d32
+
+            if swap:
+                b1_zeta[i-1] = same[i+1]
+                b2_zeta[i-1] = other[i+1]
+                bcurr = 1 - bcurr
+            else:
+                b1_zeta[i-1] = other[i+1]
+                b2_zeta[i-1] = same[i+1]
+
+        b2_end = [z_B] if z_B.imag >= 0 else []
+        if compact:
+            self.zeta = np.concatenate([[z_A], b1_zeta, [z_C], b2_zeta, b2_end])\
+                .astype(dtype)
+            self.phi = np.concatenate([[0.0], phi[2:], [2*np.pi], phi[2:] + 2*np.pi,
+                len(b2_end) * [2*np.pi]]).astype(self.zeta.real.dtype)
+            self.b1, self.b2, self.full, self.sampling = None, None, None, None
+            return
+
+        b1_zeo1 = np.full(b1_zeta.shape[0] + 1, np.nan, dtype=object)
+        b1_zeo1[0] = zeo1_A
+        b2_zeo1 = np.full(b2_zeta.shape[0] + 1 + len(b2_end), np.nan, dtype=object)
+        b2_zeo1[0] = zeo1_C
+
+        b1 = pd.DataFrame({
+            'zeta': np.concatenate([[z_A], b1_zeta]),
+            'zeo1': b1_zeo1,
+            'phi': np.concatenate([[0.0], phi[2:]])})
+        b2 = pd.DataFrame({
+            'zeta': np.concatenate([[z_C], b2_zeta, b2_end]),
+            'zeo1': b2_zeo1,
+            'phi': np.concatenate([[2*np.pi], phi[2:] + 2*np.pi,
+                                   len(b2_end) * [2*np.pi]])})
         self.b1 = b1
         self.b2 = b2
 
-        full = pd.DataFrame()
         full = pd.concat([b1, b2])
-        full['ds'] = np.abs((np.roll(full['zeta'].to_numpy(), -1) - full['zeta'])\
-                / (np.roll(full['phi'].to_numpy(), -1) - full['phi']))
-        full['s'] = np.cumsum(full['ds'].to_numpy())
-        full['s'] = full['s'] / full['s'].values[-1]
+        zeta = full['zeta'].to_numpy()
+        phi_full = full['phi'].to_numpy()
+        ds = np.abs((np.roll(zeta, -1) - zeta) / (np.roll(phi_full, -1) - phi_full))
+        full['ds'] = ds
+        full['s'] = np.cumsum(ds) / np.sum(ds)
 
         self.full = full
 
         if not uniform:
             #self.edge = self._sort_points_using_concave_hull_algo(sampling)
 #            sampling.sort_values('phi', ascending=True, inplace=True)
+            sampling = pd.DataFrame({'phi': phi, 'phi_for_roots': phi_for_roots})
+            for i in range(4):
+                sampling[f'zeta{i}'] = zz[:, i]
+                sampling[f'z{i}'] = z[:, i]
+            sampling = sampling.assign(**{
+                'ze2o1': ze2o1, 'ze2o2': ze2o2, 'ze3o1': ze3o1, 'ze3o2': ze3o2,
+                'ze2t': ze2t, 'ze3t': ze3t, 'dsze2': dsze2, 'dsze3': dsze3,
+                'dze2a': dze2a, 'dze3a': dze3a,
+                '22': a22, '23': a23, '32': a32, '33': a33,
+                'flag2223': flag2223, 'flag3332': flag3332,
+                'flag2232': flag2232, 'flag3323': flag3323,
+                'flag2to2': flag2to2, 'flag2to3': flag2to3,
+                'flag3to3': flag3to3, 'flag3to2': flag3to2})
             self.sampling = sampling
 
 
+class MagnificationMap:
+    """Binary-lens magnification map, cached as a memory-mapped .npy file.
+
+    The finite-source magnification is computed with
+    :func:`magnification_fs_2l` on a regular grid of the source plane, and
+    stored in a file whose name is a hash of the lens parameters and of the
+    grid. The map is computed only once, then opened in read-only mode, so
+    that several processes share the same pages. Light curves are obtained
+    by bilinear interpolation in the map.
+
+    Args:
+        sep: separation between primary and secondary, in units of the
+            Einstein radius.
+        q: planet-to-host star mass ratio.
+        rho: source radius in Einstein units.
+        xlim: limits of the grid along the x-axis.
+        ylim: limits of the grid along the y-axis.
+        nx: number of grid points along the x-axis.
+        ny: number of grid points along the y-axis (default: nx).
+        frame: reference frame of the map and of the trajectories, see
+            :func:`solve_lens_equation_2l`.
+        tol: relative precision on the magnification.
+        cache_dir: directory of the maps (default: ~/.cache/moana).
+
+    Keyword arguments:
+        Passed to :func:`magnification_fs_2l` (e.g., nmax, chunk).
+
+    """
+
+    def __init__(self,
+            sep: float,
+            q: float,
+            rho: float,
+            xlim: tuple = (-1.0, 1.0),
+            ylim: tuple = (-1.0, 1.0),
+            nx: int = 512,
+            ny: Optional[int] = None,
+            frame: Optional[LensReferenceFrame] = None,
+            tol: float = 1e-3,
+            cache_dir: Optional[str] = None,
+            **kwargs):
+
+        self.sep = float(sep)
+        self.q = float(q)
+        self.rho = float(rho)
+        self.xlim = (float(xlim[0]), float(xlim[1]))
+        self.ylim = (float(ylim[0]), float(ylim[1]))
+        self.nx = int(nx)
+        self.ny = self.nx if ny is None else int(ny)
+        if frame == None:
+            frame = LensReferenceFrame(center='primary', x_axis='21')
+        self.frame = frame
+        self.tol = tol
+        self.kwargs = kwargs
+        if cache_dir == None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'moana')
+        self.cache_dir = cache_dir
+
+        if (self.nx < 2) | (self.ny < 2):
+            txt = "Argument error: the grid must have at least 2x2 points."
+            sys.exit(txt)
+
+        self.x = np.linspace(self.xlim[0], self.xlim[1], self.nx)
+        self.y = np.linspace(self.ylim[0], self.ylim[1], self.ny)
+        self._map = None
+
+    @property
+    def key(self) -> str:
+        """Hash of the lens parameters and of the grid."""
+        param = [self.sep, self.q, self.rho, self.xlim, self.ylim, self.nx,
+                 self.ny, self.frame.center, self.frame.x_axis, self.tol,
+                 sorted(self.kwargs.items())]
+        return hashlib.sha1(repr(param).encode()).hexdigest()[:20]
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cache_dir, f'magmap_2l_{self.key}.npy')
+
+    @property
+    def map(self) -> np.ndarray:
+        """Magnification map (shape: ny, nx), memory-mapped in read-only mode."""
+        if self._map is None:
+            if not os.path.isfile(self.path):
+                self._compute()
+            self._map = np.load(self.path, mmap_mode='r')
+        return self._map
+
+    def _compute(self):
+        """Compute the map, row block by row block, and save it."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64,
+                                        shape=(self.ny, self.nx))
+        nrows = max(1, self.kwargs.get('chunk', 2**16) // self.nx)
+        for i in range(0, self.ny, nrows):
+            zeta = self.x[None, :] + 1j * self.y[i:i + nrows, None]
+            out[i:i + nrows] = magnification_fs_2l(self.sep, self.q, zeta,
+                self.rho, frame=self.frame, tol=self.tol, **self.kwargs)
+        out.flush()
+        del out
+        # Atomic, so that concurrent processes never read a partial map
+        os.replace(tmp, self.path)
+
+    def __call__(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """Interpolate the magnification at given source positions.
+
+        The positions outside the grid are computed with
+        :func:`magnification_fs_2l`.
+
+        Args:
+            xs: array of any shape of the source x-coordinates.
+            ys: array of the source y-coordinates, broadcast against xs.
+
+        Returns:
+            Array of the magnification.
+        """
+        xs, ys = np.broadcast_arrays(np.asarray(xs, dtype=float),
+                                     np.asarray(ys, dtype=float))
+        fx = (xs - self.xlim[0]) / (self.x[1] - self.x[0])
+        fy = (ys - self.ylim[0]) / (self.y[1] - self.y[0])
+        inside = (fx >= 0) & (fx <= self.nx - 1) & (fy >= 0) & (fy <= self.ny - 1)
+
+        i = np.clip(np.floor(np.where(inside, fx, 0)).astype(int), 0, self.nx - 2)
+        j = np.clip(np.floor(np.where(inside, fy, 0)).astype(int), 0, self.ny - 2)
+        tx = np.where(inside, fx, 0) - i
+        ty = np.where(inside, fy, 0) - j
+        m = self.map
+        magnification = (1 - ty) * ((1 - tx) * m[j, i] + tx * m[j, i + 1])\
+            + ty * ((1 - tx) * m[j + 1, i] + tx * m[j + 1, i + 1])
+
+        if not np.all(inside):
+            magnification[~inside] = magnification_fs_2l(self.sep, self.q,
+                xs[~inside] + 1j * ys[~inside], self.rho, frame=self.frame,
+                tol=self.tol, **self.kwargs)
+        return magnification
+
+    def lightcurve(self, trajectory: pd.DataFrame) -> np.ndarray:
+        """Magnification along a source trajectory.
+
+        Args:
+            trajectory: table with the source positions in columns 'xs' and
+                'ys', e.g. :obj:`moana.dbc.Output.fitlc`.
+
+        Returns:
+            Array of the magnification.
+        """
+        return self(trajectory['xs'].to_numpy(), trajectory['ys'].to_numpy())
+
+
+class CausticCache:
+    """Process-wide LRU cache of sampled caustics.
+
+    The caustics are keyed by (sep, q, ntot, frame), where sep and q are
+    rounded to a given number of significant digits, and are computed with
+    these rounded values. The least recently used caustics are evicted when
+    the total memory exceeds max_bytes.
+
+    Args:
+        max_bytes: memory limit of the cache, in bytes.
+        digits: number of significant digits of sep and q in the keys.
+
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, digits: int = 10):
+
+        self.max_bytes = max_bytes
+        self.digits = digits
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.clear()
+
+    def _key(self, sep, q, ntot, frame):
+        rnd = lambda x: float(f'{float(x):.{self.digits}g}')
+        return (rnd(sep), rnd(q), int(ntot), frame.center, frame.x_axis)
+
+    @staticmethod
+    def _nbytes(caustic) -> int:
+        """Memory of all the arrays and tables held by the caustic."""
+        nbytes = 0
+        for x in vars(caustic).values():
+            if isinstance(x, np.ndarray):
+                nbytes += x.nbytes
+            elif isinstance(x, pd.DataFrame):
+                nbytes += x.memory_usage(deep=True).sum()
+        return int(nbytes)
+
+    def get(self, sep: float, q: float, ntot: int,
+            frame: LensReferenceFrame) -> ResonantCaustic:
+        """Return the caustic, sampled if not in the cache.
+
+        The positions of the caustic in the frame are stored in the attribute
+        edge of the returned :class:`ResonantCaustic`.
+        """
+        key = self._key(sep, q, ntot, frame)
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key][0]
+            self.misses += 1
+
+        sep, q = key[0], key[1]
+        caustic = ResonantCaustic(sep=sep, q=q)
+        caustic._sample(ntot)
+        # The table of the branch tracker is only used by diagnostics(),
+        # which samples the caustic again
+        caustic.sampling = None
+        caustic.edge = _primary_to_frame_2l(caustic.full['zeta'].to_numpy(),
+                                            sep, q, frame)
+        nbytes = self._nbytes(caustic)
+
+        with self._lock:
+            if key not in self._data:
+                self._data[key] = (caustic, nbytes)
+                self.nbytes += nbytes
+            self._data.move_to_end(key)
+            while (self.nbytes > self.max_bytes) & (len(self._data) > 1):
+                _, (_, n) = self._data.popitem(last=False)
+                self.nbytes -= n
+                self.evictions += 1
+        return caustic
+
+    def clear(self):
+        """Empty the cache and reset the statistics."""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """Hits, misses, evictions, number of caustics and memory in bytes."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._data),
+                    'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+caustic_cache = CausticCache()
+
+
+def caustic_atlas(
+        sep: np.ndarray,
+        q: np.ndarray,
+        path: str,
+        ntot: int = 200,
+        grid: bool = False,
+        chunk: int = 64,
+        processes: Optional[int] = None):
+    """Sample many caustics in parallel and store them on disk.
+
+    The caustics are computed with :class:`ResonantCaustic` in a pool of
+    processes, by chunks of caustics. Each chunk is saved in its own .npz
+    file of the directory path as soon as it is completed, so that an
+    interrupted run resumes with the missing chunks only.
+
+    Args:
+        sep: list of separations, broadcast against q.
+        q: list of lens mass ratios.
+        path: directory of the atlas.
+        ntot: number of angles of each caustic.
+        grid: if True, use all the combinations of sep and q.
+        chunk: number of caustics per file.
+        processes: number of processes (default: number of CPUs).
+
+    Returns:
+        Number of chunks computed during this call.
+    """
+    sep, q = np.asarray(sep, dtype=float), np.asarray(q, dtype=float)
+    if grid:
+        sep, q = np.meshgrid(sep.ravel(), q.ravel(), indexing='ij')
+    sep, q = [a.ravel() for a in np.broadcast_arrays(sep, q)]
+
+    os.makedirs(path, exist_ok=True)
+    fname = os.path.join(path, 'index.npz')
+    if os.path.isfile(fname):
+        index = np.load(fname)
+        if not (np.array_equal(index['sep'], sep) & np.array_equal(index['q'], q)
+                & (index['ntot'] == ntot) & (index['chunk'] == chunk)):
+            txt = f"Error: {path} contains an atlas with other parameters."
+            sys.exit(txt)
+    else:
+        save_npz_atomic(fname, sep=sep, q=q, ntot=ntot, chunk=chunk)
+
+    todo = [i for i in range(0, sep.shape[0], chunk)
+            if not os.path.isfile(_atlas_chunk_name(path, i // chunk))]
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        jobs = {pool.submit(_atlas_chunk, sep[i:i + chunk], q[i:i + chunk],
+                            ntot): i for i in todo}
+        for job in concurrent.futures.as_completed(jobs):
+            i = jobs[job]
+            save_npz_atomic(_atlas_chunk_name(path, i // chunk),
+                id=np.arange(i, i + len(sep[i:i + chunk])), **job.result())
+    return len(todo)
+
+def load_caustic_atlas(path: str) -> pd.DataFrame:
+    """Read the caustics computed by :func:`caustic_atlas`.
+
+    Args:
+        path: directory of the atlas.
+
+    Returns:
+        Table with one row per caustic point, with columns: id (caustic
+            number), sep, q, phi, zeta (in the frame of
+            :func:`lens_equation_2l`) and s (normalized curvilinear
+            abscissa). The caustics of missing chunks are not included.
+    """
+    index = np.load(os.path.join(path, 'index.npz'))
+    nchunks = -(-index['sep'].shape[0] // int(index['chunk']))
+    tables = []
+    for k in range(nchunks):
+        fname = _atlas_chunk_name(path, k)
+        if os.path.isfile(fname):
+            x = np.load(fname)
+            count = x['count']
+            tables.append(pd.DataFrame({'id': np.repeat(x['id'], count),
+                'sep': np.repeat(x['sep'], count), 'q': np.repeat(x['q'], count),
+                'phi': x['phi'], 'zeta': x['zeta'], 's': x['s']}))
+    if len(tables) == 0:
+        return pd.DataFrame(columns=['id', 'sep', 'q', 'phi', 'zeta', 's'])
+    return pd.concat(tables, ignore_index=True)
+
+def _atlas_chunk(sep, q, ntot):
+    """Sample the caustics of a chunk, concatenated in flat arrays."""
+    count, phi, zeta, s = [], [], [], []
+    for a, b in zip(sep, q):
+        caustic = ResonantCaustic(sep=a, q=b)
+        caustic._sample(ntot)
+        count.append(len(caustic.full))
+        phi.append(caustic.full['phi'].to_numpy(dtype=float))
+        zeta.append(caustic.full['zeta'].to_numpy(dtype=complex))
+        s.append(caustic.full['s'].to_numpy(dtype=float))
+    return {'sep': sep, 'q': q, 'count': np.array(count),
+            'phi': np.concatenate(phi), 'zeta': np.concatenate(zeta),
+            's': np.concatenate(s)}
+
+def _atlas_chunk_name(path, k):
+    return os.path.join(path, f'chunk_{k:06d}.npz')
+
+
+# FUNCTIONS FOR 1-BODY LENSES
+# ===========================
+
+def magnification_1l(u: np.ndarray) -> np.ndarray:
+    """Compute the point-source magnification by a single lens.
+
+    Args:
+        u: array of any shape of the lens-source distances.
+
+    Returns:
+        Array of the magnification.
+    """
+    u = np.abs(np.asarray(u, dtype=float))
+    with np.errstate(divide='ignore'):
+        return (u**2 + 2) / (u * np.sqrt(u**2 + 4))
+
+def magnification_fs_1l(u: np.ndarray, rho: np.ndarray,
+        n: int = 64) -> np.ndarray:
+    """Compute the magnification of a uniform finite source by a single lens.
+
+    In polar coordinates centered on the lens, the radial integral of the
+    point-source magnification is F(r) = r sqrt(r^2 + 4) / 2, so that only
+    an integral over the polar angle is computed, with a Gauss-Legendre
+    quadrature of n nodes (Lee et al., 2009).
+
+    Args:
+        u: array of any shape of the lens-source distances.
+        rho: source radius in Einstein units, broadcast against u.
+        n: number of nodes of the quadrature.
+
+    Returns:
+        Array of the magnification.
+    """
+    u, rho = np.broadcast_arrays(np.abs(np.asarray(u, dtype=float)),
+                                 np.asarray(rho, dtype=float))
+    x, w = np.polynomial.legendre.leggauss(n)
+    x, w = 0.5 * (x + 1), 0.5 * w
+    F = lambda r: 0.5 * r * np.sqrt(r**2 + 4)
+    u_, rho_ = u[..., None], rho[..., None]
+
+    # Lens inside the source: theta in [0, pi], from the lens to the limb
+    theta = np.pi * x
+    chord = np.sqrt(np.maximum(rho_**2 - (u_ * np.sin(theta))**2, 0))
+    inside = np.pi * np.sum(w * F(u_ * np.cos(theta) + chord), axis=-1)
+
+    # Lens outside the source: theta in [0, theta_max], where the square
+    # root vanishes like (1 - x) with theta = theta_max sin(pi x / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta_max = np.arcsin(np.minimum(rho_ / u_, 1))
+    theta = theta_max * np.sin(0.5 * np.pi * x)
+    jac = theta_max * 0.5 * np.pi * np.cos(0.5 * np.pi * x)
+    chord = np.sqrt(np.maximum(rho_**2 - (u_ * np.sin(theta))**2, 0))
+    outside = np.sum(w * jac * (F(u_ * np.cos(theta) + chord)
+                                - F(u_ * np.cos(theta) - chord)), axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnification = 2 * np.where(u < rho, inside, outside) / (np.pi * rho**2)
+    return np.where(rho > 0, magnification, magnification_1l(u))
+
+
 # FUNCTIONS FOR 2-BODY LENSES
 # ===========================
 
@@ -296,20 +874,127 @@ def critic_2l(
     - the heaviest body (mass m1) is the origin;
     - the lightest body (mass m2) is at (-s, 0).
 
+    The arguments are broadcast against each other, so that a whole array of
+    angles (and, optionally, of separations and mass ratios) is solved in a
+    single call.
+
     Args:
         s: separation
         q: the lens mass ratio q = m2/m1.
         phi: the angle parameter in [0,2*pi].
 
     Returns:
-        numpy array of the complex roots.
+        numpy array of the complex roots, with shape (4,) if all the arguments
+            are scalars, and shape (n, 4) otherwise.
     """
-    coefs = [1, 2 * s, s ** 2 - np.exp(1j * phi),
-             -2 * s * np.exp(1j * phi) / (1 + q),
-             -(s ** 2 * np.exp(1j * phi) / (1 + q))]
-    result = np.roots(coefs)
+    s, q, phi = np.broadcast_arrays(
+        np.asarray(s, dtype=float), np.asarray(q, dtype=float),
+        np.asarray(phi, dtype=float))
+    scalar = s.ndim == 0
+    s, q, phi = s.ravel(), q.ravel(), phi.ravel()
+
+    eiphi = np.exp(1j * phi)
+    coefs = np.empty((s.shape[0], 5), dtype=complex)
+    coefs[:, 0] = 1
+    coefs[:, 1] = 2 * s
+    coefs[:, 2] = s ** 2 - eiphi
+    coefs[:, 3] = -2 * s * eiphi / (1 + q)
+    coefs[:, 4] = -(s ** 2 * eiphi / (1 + q))
+    result = polyroots(coefs)
+    if scalar:
+        return result[0]
     return result
 
+def track_critic_2l(
+        s: float,
+        q: float,
+        phi: np.ndarray,
+        stride: int = 8,
+        niter: int = 8,
+        tol: float = 1e-12) -> np.ndarray:
+    """Follow the solutions of the Witt equation along increasing angles.
+
+    The roots are computed with :func:`critic_2l` every stride angles only.
+    From each of these nodes, the roots are continued to the next angles
+    (all the nodes at once): they are predicted from dz/dphi, then refined
+    with Newton's method. If Newton's method does not converge, or if two
+    roots merge, the roots are computed with :func:`critic_2l` and matched
+    to the predictions instead. Finally, the roots of consecutive nodes are
+    matched, so that each column of the result is a continuous branch.
+
+    Args:
+        s: separation.
+        q: the lens mass ratio q = m2/m1.
+        phi: sorted array of the angle parameter.
+        stride: number of angles between two nodes.
+        niter: maximum number of Newton iterations per angle.
+        tol: relative precision of Newton's method.
+
+    Returns:
+        numpy array (shape: n, 4) of the complex roots, where the root in a
+            given column is continuous with phi.
+    """
+    phi = np.asarray(phi, dtype=float).ravel()
+    n = phi.shape[0]
+    nodes = np.arange(0, n, stride)
+    z = np.empty((n, 4), dtype=complex)
+    z[nodes] = critic_2l(s, q, phi[nodes]).reshape(-1, 4)
+
+    # P(z) = z^4 + 2s z^3 + (s^2 - e) z^2 + c3 e z + c4 e, with e = exp(i phi)
+    eiphi = np.exp(1j * phi)
+    c3 = -2 * s / (1 + q)
+    c4 = -s**2 / (1 + q)
+
+    # Continue the roots of each node up to the next node (included)
+    current = z[nodes]
+    for k in range(1, stride + 1):
+        idx = nodes + k
+        valid = idx < n
+        if not np.any(valid):
+            break
+        idx = idx[valid]
+        zk = current[valid]
+        e = eiphi[idx - 1][:, None]
+        dp = ((4 * zk + 6 * s) * zk + 2 * (s**2 - e)) * zk + c3 * e
+        dzdphi = 1j * e * ((zk - c3) * zk - c4) / dp
+        zk = zk + dzdphi * (phi[idx] - phi[idx - 1])[:, None]
+        pred = zk
+        e = eiphi[idx][:, None]
+        for _ in range(niter):
+            p = (((zk + 2 * s) * zk + s**2 - e) * zk + c3 * e) * zk + c4 * e
+            dp = ((4 * zk + 6 * s) * zk + 2 * (s**2 - e)) * zk + c3 * e
+            step = p / dp
+            zk = zk - step
+            converged = np.abs(step) <= tol * (1 + np.abs(zk))
+            if np.all(converged):
+                break
+
+        # Fall back to a full solve
+        gap = np.abs(zk[:, :, None] - zk[:, None, :]) + np.diag(np.full(4, np.inf))
+        bad = ~np.all(converged, axis=-1) | (np.min(gap, axis=(-2, -1)) < 1e-8)
+        if np.any(bad):
+            roots = critic_2l(s, q, phi[idx[bad]]).reshape(-1, 4)
+            match = _greedy_match(np.abs(pred[bad][:, :, None] - roots[:, None, :]))
+            zk[bad] = np.take_along_axis(roots, match, axis=-1)
+
+        current[valid] = zk
+        if k < stride:
+            z[idx] = zk
+        else:
+            ends = current[:-1]
+
+    # Relabel the roots of each node to continue the previous branches
+    blocks = np.repeat(np.arange(nodes.shape[0]), stride)[:n]
+    if nodes.shape[0] > 1:
+        dist = np.abs(ends[:, :, None] - z[nodes[1:]][:, None, :])
+        perm = _greedy_match(dist)
+        labels = np.empty((nodes.shape[0], 4), dtype=int)
+        labels[0] = np.arange(4)
+        for b in range(nodes.shape[0] - 1):
+            labels[b + 1] = perm[b][labels[b]]
+        z = np.take_along_axis(z, labels[blocks], axis=-1)
+    return z
+
 def lens_equation_2l(
     xcoords: float, 
     eps: float, 
@@ -330,37 +1015,556 @@ def lens_equation_2l(
     """
     return np.array(z - wk(np.conj(z), xcoords, eps, 1))
 
-def get_dzeta_phi(s, q, z):
+def get_dzeta_phi(s, q, z, order=2):
+    """Derivatives of the caustic with respect to the angle parameter.
+
+    The critical curve is defined by W_2(z(phi)) = W_2(z(0)) exp(-i phi), so
+    that the successive derivatives of W_2(z(phi)) give those of z, and
+    then those of zeta = z - conj(W_1(z)).
+
+    Args:
+        s: separation.
+        q: the lens mass ratio q = m2/m1.
+        z: array of any shape of critical points, see :func:`critic_2l`.
+        order: highest order of the derivatives, from 1 to 4.
+
+    Returns:
+        Tuple with the order first derivatives of zeta.
+    """
+    if order not in (1, 2, 3, 4):
+        sys.exit("Argument error: order must be 1, 2, 3 or 4.")
 
     s_list = np.array([0.0, -np.abs(s)])
     eps_list = np.array([1.0/(1.0+q), q/(1.0+q)])
-    w_2 = wk(z, s_list, eps_list, 2)
-    w_3 = wk(z, s_list, eps_list, 3)
-    w_4 = wk(z, s_list, eps_list, 4)
-    # w_5 = wk(z, s_list, eps_list, 5)
-    # w_6 = wk(z, s_list, eps_list, 6)
+    w = wk_orders(z, s_list, eps_list, np.arange(2, order + 3))
+    w_2, w_3, w_4, w_5, w_6 = list(w) + [None] * (4 - order)
 
     dz_dphi = -1j * w_2 / w_3
     dzeta_dphi = dz_dphi - np.conj(w_2 * dz_dphi)
+    derivatives = [dzeta_dphi]
+
+    if order > 1:
+        d2z_dphi2 = - 1j * dz_dphi - w_4 * np.power(dz_dphi,2) / w_3
+        d2zeta_dphi2 = d2z_dphi2 - np.conj(w_3 * np.power(dz_dphi,2) + w_2 * d2z_dphi2)
+        derivatives.append(d2zeta_dphi2)
+
+    if order > 2:
+        d3z_dphi3 = - dz_dphi - (w_5 * np.power(dz_dphi, 3)
+            + 3 * w_4 * dz_dphi * d2z_dphi2) / w_3
+        d3zeta_dphi3 = d3z_dphi3 - np.conj(w_4 * np.power(dz_dphi, 3)
+            + 3 * w_3 * dz_dphi * d2z_dphi2 + w_2 * d3z_dphi3)
+        derivatives.append(d3zeta_dphi3)
+
+    if order > 3:
+        d4z_dphi4 = 1j * dz_dphi - (w_6 * np.power(dz_dphi, 4)
+            + 6 * w_5 * np.power(dz_dphi, 2) * d2z_dphi2
+            + w_4 * (3 * np.power(d2z_dphi2, 2) + 4 * dz_dphi * d3z_dphi3)) / w_3
+        d4zeta_dphi4 = d4z_dphi4 - np.conj(w_5 * np.power(dz_dphi, 4)
+            + 6 * w_4 * np.power(dz_dphi, 2) * d2z_dphi2
+            + w_3 * (3 * np.power(d2z_dphi2, 2) + 4 * dz_dphi * d3z_dphi3)
+            + w_2 * d4z_dphi4)
+        derivatives.append(d4zeta_dphi4)
+
+    return tuple(derivatives)
+
+def solve_lens_equation_2l(
+        sep: np.ndarray,
+        q: np.ndarray,
+        zeta: np.ndarray,
+        frame: Optional[LensReferenceFrame] = None,
+        tol: float = 1e-6):
+    """Find the images of point sources by a binary lens.
+
+    The lens equation is turned into a fifth-order polynomial in z, which is
+    solved for all the sources at once with :func:`polyroots`. The roots
+    that do not satisfy the lens equation are flagged as false images.
+
+    By default, use the convention of :func:`lens_equation_2l`:
+    - the heaviest body (mass m1) is the origin;
+    - the lightest body (mass m2) is at (-s, 0).
+
+    Args:
+        sep: separation, broadcast against zeta.
+        q: the lens mass ratio q = m2/m1, broadcast against zeta.
+        zeta: array of any shape of the source positions.
+        frame: reference frame of zeta and of the images.
+        tol: maximum distance in the source plane between zeta and the
+            lens equation applied to a true image.
+
+    Returns:
+        Tuple with the images (shape: zeta.shape + (5,), type: complex) and
+            a boolean mask of the true images, with the same shape.
+    """
+    if frame is not None:
+        zeta = _frame_to_primary_2l(zeta, sep, q, frame)
+    images, mask, _ = _solve_2l(sep, q, zeta, tol)
+    if frame is not None:
+        images = _primary_to_frame_2l(images, sep, q, frame)
+    return images, mask
+
+def magnification_2l(
+        sep: np.ndarray,
+        q: np.ndarray,
+        zeta: np.ndarray,
+        frame: Optional[LensReferenceFrame] = None,
+        return_images: bool = False):
+    """Compute the point-source magnification by a binary lens.
+
+    Args:
+        sep: separation, broadcast against zeta.
+        q: the lens mass ratio q = m2/m1, broadcast against zeta.
+        zeta: array of any shape of the source positions.
+        frame: reference frame of zeta, see :func:`solve_lens_equation_2l`.
+        return_images: if True, also return the images and the mask of true
+            images, as in :func:`solve_lens_equation_2l`.
+
+    Returns:
+        Array with the same shape as zeta of the total magnification.
+    """
+    if frame is not None:
+        zeta = _frame_to_primary_2l(zeta, sep, q, frame)
+    images, mask, jacobian = _solve_2l(sep, q, zeta)
+    magnification = np.sum(np.where(mask, 1.0 / np.abs(jacobian), 0.0), axis=-1)
+    if return_images:
+        if frame is not None:
+            images = _primary_to_frame_2l(images, sep, q, frame)
+        return magnification, images, mask
+    return magnification
+
+def magnification_fs_2l(
+        sep: float,
+        q: float,
+        zeta: np.ndarray,
+        rho: np.ndarray,
+        frame: Optional[LensReferenceFrame] = None,
+        tol: float = 1e-3,
+        npts: int = 64,
+        nmax: int = 2**14,
+        chunk: int = 2**16) -> np.ndarray:
+    """Compute the magnification of a uniform finite source by a binary lens.
+
+    For each source, the point-source magnification and its hexadecapole
+    approximation (Gould, 2008) are first computed. Far from the caustics,
+    the point-source (or, if needed, the hexadecapole) magnification is
+    used. Otherwise, the images of the source boundary are computed for
+    npts angles, connected between consecutive angles, and the area of the
+    images is computed with Green's theorem. The angular intervals with the
+    largest errors are split until the relative precision tol is reached, or
+    until nmax points on the boundary.
+
+    When the source boundary passes within 1e-5 rho of a lens, the images of
+    the boundary points closest to the lens are too poorly determined for
+    the contour integration. The magnification is then interpolated between
+    the two sources moved along the lens-source direction, so that the
+    boundary passes at 2e-5 rho of the lens on each side. A contour
+    integration that still gives a magnification below 1 is computed again
+    with angles rotated by half a step, and NaN is returned if the result is
+    still below 1, with a RuntimeWarning giving the number of such sources.
+
+    Args:
+        sep: separation, broadcast against zeta, so that many models can be
+            computed in one call.
+        q: the lens mass ratio q = m2/m1, broadcast against zeta.
+        zeta: array of any shape of the source positions.
+        rho: source radius in Einstein units (e.g., rho in
+            :obj:`moana.dbc.Output.param`), broadcast against zeta.
+        frame: reference frame of zeta, see :func:`solve_lens_equation_2l`.
+        tol: relative precision on the magnification.
+        npts: initial number of points on the source boundary.
+        nmax: maximum number of points on the source boundary.
+        chunk: maximum number of points solved, or stored for the contour
+            integration, at once; the memory does not depend on the number
+            of sources.
 
-    d2z_dphi2 = w_2 / w_4
-    d2zeta_dphi2 = d2z_dphi2 - np.conj(w_3 * np.power(dz_dphi,2))
+    Returns:
+        Array with the same shape as zeta of the magnification.
+    """
+    if frame is not None:
+        zeta = _frame_to_primary_2l(zeta, sep, q, frame)
+    sep, q, zeta, rho = np.broadcast_arrays(np.asarray(sep, dtype=float),
+        np.asarray(q, dtype=float), np.asarray(zeta, dtype=complex),
+        np.asarray(rho, dtype=float))
+    shape = zeta.shape
+    sep, q, zeta, rho = sep.ravel(), q.ravel(), zeta.ravel(), rho.ravel()
+    options = (tol, npts, nmax, chunk)
+
+    # Sources whose boundary passes too close to a lens
+    delta = 2e-5
+    near = np.zeros(zeta.shape, dtype=bool)
+    lens = np.zeros(zeta.shape, dtype=complex)
+    for zl in [np.zeros(zeta.shape), -sep]:
+        close = (np.abs(np.abs(zeta - zl) - rho) < 0.5 * delta * rho)\
+            & (rho > 0) & ~near
+        near |= close
+        lens[close] = zl[close]
+
+    magnification = np.empty(zeta.shape)
+    magnification[~near] = _magnification_fs_2l(sep[~near], q[~near],
+        zeta[~near], rho[~near], *options)
+    idx = np.flatnonzero(near)
+    if idx.shape[0] > 0:
+        d = np.abs(zeta[idx] - lens[idx])
+        direction = (zeta[idx] - lens[idx]) / d
+        a = [_magnification_fs_2l(sep[idx], q[idx], lens[idx] + direction
+            * rho[idx] * (1 + sign * delta), rho[idx], *options)
+            for sign in [-1, 1]]
+        x = (d / rho[idx] - 1 + delta) / (2 * delta)
+        magnification[idx] = a[0] + (a[1] - a[0]) * x
+
+    nfailed = np.sum(~np.isfinite(magnification))
+    if nfailed > 0:
+        warnings.warn(f"{nfailed} of {magnification.shape[0]} finite-source"
+                      " magnifications could not be computed and are NaN.",
+                      RuntimeWarning, stacklevel=2)
+    return magnification.reshape(shape)
+
+def _magnification_fs_2l(sep, q, zeta, rho, tol, npts, nmax, chunk):
+    """Finite-source magnification, for flat arrays of lenses and sources."""
+    magnification = np.empty(zeta.shape)
+    near = np.zeros(zeta.shape, dtype=bool)
+
+    # Point-source and hexadecapole approximations on 13 points
+    offsets = np.concatenate([[0], np.exp(0.5j * np.pi * np.arange(4)),
+        np.exp(0.5j * np.pi * (np.arange(4) + 0.5)),
+        0.5 * np.exp(0.5j * np.pi * np.arange(4))])
+    step = max(1, chunk // offsets.shape[0])
+    for i in range(0, zeta.shape[0], step):
+        sl = slice(i, i + step)
+        _, mask, jacobian = _solve_2l(sep[sl, None], q[sl, None],
+            zeta[sl, None] + rho[sl, None] * offsets)
+        a = np.sum(np.where(mask, 1.0 / np.abs(jacobian), 0.0), axis=-1)
+        a_0 = a[:, 0]
+        a_plus = np.mean(a[:, 1:5], axis=-1) - a_0
+        a_cross = np.mean(a[:, 5:9], axis=-1) - a_0
+        a_half = np.mean(a[:, 9:13], axis=-1) - a_0
+        a_2 = (16.0 * a_half - a_plus) / 3.0
+        a_4 = 0.5 * (a_plus + a_cross) - a_2
+        a_hex = a_0 + 0.5 * a_2 + a_4 / 3.0
+
+        magnification[sl] = np.where(np.abs(a_hex - a_0) < tol * a_0, a_0, a_hex)
+        n_images = np.sum(mask, axis=-1)
+        near[sl] = ((np.abs(a_4) / 3.0 > tol * a_hex)
+            | np.any(n_images != n_images[:, :1], axis=-1)) & (rho[sl] > 0)
+
+    # Contour integration close to the caustics; a magnification below 1 is
+    # computed again with rotated angles, and rejected if still below 1
+    idx = np.flatnonzero(near)
+    for theta0 in [0.0, np.pi / npts]:
+        if idx.shape[0] == 0:
+            break
+        magnification[idx] = _contour_magnification_2l(sep[idx], q[idx],
+            zeta[idx], rho[idx], tol, npts, nmax, chunk, theta0)
+        idx = idx[~(magnification[idx] >= 1)]
+    magnification[idx] = np.nan
+    return magnification
+
+def _contour_magnification_2l(sep, q, zeta, rho, tol, npts, nmax, chunk,
+        theta0=0.0):
+    """Finite-source magnification from the images of the source boundary.
+
+    The boundaries of the sources being integrated are stored in flat
+    arrays, and at each iteration the angular intervals with the largest
+    errors are split in two, until the total error of each source is smaller
+    than tol. The area of each interval is kept until the interval is split.
+    New sources are started while at most chunk points are stored, and the
+    converged sources are removed.
+    """
+    m = zeta.shape[0]
+    area_tot = np.zeros(m)
+    empty_c = np.empty((0, 5), dtype=complex)
+    eid = np.empty(0, dtype=int)
+    theta, area, error = np.empty(0), np.empty(0), np.empty(0)
+    images, dz, mask, parity = empty_c, empty_c, np.empty((0, 5), dtype=bool),\
+        np.empty((0, 5))
+    new = np.empty(0, dtype=bool)
+    start = 0
+
+    while (start < m) or (eid.shape[0] > 0):
+        # Start new sources
+        nstart = max(0, min(m - start, (chunk - eid.shape[0]) // npts))
+        if (nstart == 0) & (eid.shape[0] == 0):
+            nstart = 1
+        if nstart > 0:
+            new_eid = np.repeat(np.arange(start, start + nstart), npts)
+            new_theta = np.tile(theta0 + 2 * np.pi * np.arange(npts) / npts,
+                                nstart)
+            start += nstart
+        else:
+            new_eid, new_theta = np.empty(0, dtype=int), np.empty(0)
+        x = _boundary_images_2l(sep[new_eid], q[new_eid], zeta[new_eid],
+                                rho[new_eid], new_theta, chunk)
+        eid = np.concatenate([eid, new_eid])
+        theta = np.concatenate([theta, new_theta])
+        images, mask, parity, dz = [np.concatenate([a, b]) for a, b in
+            zip([images, mask, parity, dz], x)]
+        area = np.concatenate([area, np.zeros(new_eid.shape[0])])
+        error = np.concatenate([error, np.zeros(new_eid.shape[0])])
+        new = np.concatenate([new, np.ones(new_eid.shape[0], dtype=bool)])
+
+        order = np.lexsort((theta, eid))
+        eid, theta, images, mask, parity, dz, area, error, new = [a[order]
+            for a in [eid, theta, images, mask, parity, dz, area, error, new]]
+
+        # Next point on the same boundary
+        sources, first, count = np.unique(eid, return_index=True,
+                                          return_counts=True)
+        rank = np.searchsorted(sources, eid)
+        nxt = np.arange(eid.shape[0]) + 1
+        nxt[first + count - 1] = first
+        h = np.mod(theta[nxt] - theta, 2 * np.pi)
+
+        # Area of the new intervals only
+        k = np.flatnonzero(new | new[nxt])
+        j = nxt[k]
+        area[k], error[k] = _interval_area(
+            (images[k], mask[k], parity[k], dz[k]),
+            (images[j], mask[j], parity[j], dz[j]), h[k])
+        new[:] = False
+        area_src = np.bincount(rank, area, minlength=sources.shape[0])
+        error_src = np.bincount(rank, error, minlength=sources.shape[0])
+
+        # Intervals to split, within the limit of chunk points
+        allowed = tol * np.abs(area_src)
+        todo = (error_src > allowed) & (count < nmax)
+        split = todo[rank] & (error > allowed[rank] / count[rank]) & (h > 1e-9)
+        nsplit = np.bincount(rank, split, minlength=sources.shape[0])
+        done = nsplit == 0
+        area_tot[sources[done]] = area_src[done]
+
+        # Remove the converged sources; the first source is always refined
+        keep = ~done[rank]
+        if not np.all(done):
+            free = max(chunk - np.sum(keep), nsplit[~done][0])
+            split &= (np.cumsum(nsplit) <= free)[rank]
+        idx = np.flatnonzero(split)
+        new_eid = eid[idx]
+        new_theta = theta[idx] + 0.5 * h[idx]
+        x = _boundary_images_2l(sep[new_eid], q[new_eid], zeta[new_eid],
+                                rho[new_eid], new_theta, chunk)
+        eid, theta, images, mask, parity, dz, area, error, new = [
+            np.concatenate([a[keep], b]) for a, b in zip(
+            [eid, theta, images, mask, parity, dz, area, error, new],
+            [new_eid, new_theta] + list(x) + [np.zeros(idx.shape[0]),
+            np.zeros(idx.shape[0]), np.ones(idx.shape[0], dtype=bool)])]
+
+    return area_tot / (np.pi * rho**2)
+
+def _boundary_images_2l(sep, q, zeta, rho, theta, chunk):
+    """Images of points on source boundaries, their parity and dz/dtheta."""
+    images = np.empty(zeta.shape + (5,), dtype=complex)
+    mask = np.empty(zeta.shape + (5,), dtype=bool)
+    w_2 = np.empty(zeta.shape + (5,), dtype=complex)
+    for i in range(0, zeta.shape[0], chunk):
+        sl = slice(i, i + chunk)
+        images[sl], mask[sl], w_2[sl] = _solve_2l(sep[sl], q[sl],
+            zeta[sl] + rho[sl] * np.exp(1j * theta[sl]), jacobian=False)
+
+    a = np.conj(w_2)
+    jacobian = 1.0 - np.abs(a)**2
+    dzeta = (1j * rho * np.exp(1j * theta))[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dz = (dzeta + a * np.conj(dzeta)) / jacobian
+    parity = np.sign(jacobian)
+
+    # The parities of the images must add up to -1. Otherwise, flip the image
+    # closest to the critical curve, where the sign of the Jacobian is unsure.
+    total = np.sum(np.where(mask, parity, 0), axis=-1)
+    for sign in [1, -1]:
+        closest = np.argmin(np.where(mask & (parity == sign), np.abs(jacobian),
+                                     np.inf), axis=-1)[..., None]
+        flip = (total == 2 * sign - 1)[..., None]
+        np.put_along_axis(parity, closest, np.where(flip, -sign,
+            np.take_along_axis(parity, closest, axis=-1)), axis=-1)
+    return images, mask, parity, dz
+
+def _interval_area(a, b, h):
+    """Contribution of angular intervals to the area of the images.
+
+    The image contours are approximated by parabolas between consecutive
+    points (Bozza, 2010), and the area is computed with Green's theorem.
 
-    # d3z_dphi3 = - 1j * w_2 / w_5
-    # d3zeta_dphi2 = d3z_dphi3 - np.conj(w_4 * np.power(dz_dphi, 2))
-    # d3zeta_dphi2 = d3zeta_dphi2 - 2 * np.conj(w_3 * dz_dphi * d2z_dphi2)
+    Args:
+        a: tuple with, at the first point of n intervals, the array (shape:
+            n, k) of the k images, the mask of the true images, the sign of
+            the Jacobian of the lens equation at the images, and the
+            derivative of the images with respect to the angle on the
+            source boundary.
+        b: same tuple at the last point of the intervals.
+        h: angle between the two points.
 
-    # d4z_dphi4 = - w_2 / w_6
-    # d4zeta_dphi4 = d4z_dphi4 - np.conj(w_5 * np.power(dz_dphi,3))
-    # d4zeta_dphi4 = d4zeta_dphi4 - 4 * np.conj(w_4 * d2z_dphi2 * dz_dphi)
-    # d4zeta_dphi4 = d4zeta_dphi4 - 2 * w_3 * (d3z_dphi3 * dz_dphi + np.power(d2z_dphi2,2))
-    
-    return dzeta_dphi, d2zeta_dphi2 #, d3zeta_dphi2, d4zeta_dphi4
+    Returns:
+        Tuple with the area and the error estimate of each interval.
+    """
+    z, mask, parity, dz = a
+    zn, mask_n, parity_n, dzn = b
+
+    # Connect the images with the same parity between two consecutive points
+    d = np.abs(z[:, :, None] - zn[:, None, :])
+    allowed = mask[:, :, None] & mask_n[:, None, :]\
+        & (parity[:, :, None] == parity_n[:, None, :])
+    match = _greedy_match(np.where(allowed, d, np.inf))
+    ok = match >= 0
+    j = np.maximum(match, 0)
+    znext = np.take_along_axis(zn, j, axis=-1)
+    dznext = np.take_along_axis(dzn, j, axis=-1)
+    chord = 0.5 * np.imag(np.conj(z) * znext)
+    parabola = np.imag(np.conj(dz) * dznext) * h[:, None]**2 / 12.0
+    parabola = np.where(np.isfinite(parabola), parabola, 0.0)
+    area = np.sum(np.where(ok, parity * (chord + parabola), 0.0), axis=-1)
+    error = np.sum(np.where(ok, np.abs(parabola), 0.0), axis=-1)
+
+    # Images created (destroyed) in pairs on the critical curves close the
+    # contours: connect the new (last) positive and negative parity images
+    matched = np.any(match[:, :, None] == np.arange(z.shape[-1]), axis=-2)
+    for x in [_pair_area(zn, mask_n & ~matched, parity_n, 1),
+              _pair_area(z, mask & ~ok, parity, -1)]:
+        area += x[0]
+        error += x[1]
+    return area, error
+
+def _pair_area(z, selected, parity, sign):
+    """Green's theorem term of the segments between paired images.
+
+    The error is estimated from the squared length of the segments, because
+    the contours are not smooth where they cross the critical curves.
+    """
+    d = np.abs(z[..., :, None] - z[..., None, :])
+    allowed = selected[..., :, None] & selected[..., None, :]\
+        & (parity[..., :, None] > 0) & (parity[..., None, :] < 0)
+    match = _greedy_match(np.where(allowed, d, np.inf))
+    zneg = np.take_along_axis(z, np.maximum(match, 0), axis=-1)
+    ok = match >= 0
+    area = np.sum(np.where(ok, 0.5 * sign * np.imag(np.conj(zneg) * z), 0.0),
+                  axis=-1)
+    error = np.sum(np.where(ok, np.abs(z - zneg)**2, 0.0), axis=-1) / 8.0
+    return area, error
+
+def _greedy_match(d: np.ndarray) -> np.ndarray:
+    """Match rows and columns of distance matrices, closest pairs first.
 
-def solve_lens_equation_2l(sep, q, x):
-    y = np.atleast_1d(x)
-    z = [critic_2l(sep, q, a) for a in y]
-    return np.array([lel2(sep, q, zc) for zc in z])
+    Args:
+        d: array (shape: ..., k, k) of distances; forbidden pairs are inf.
+
+    Returns:
+        Array (shape: ..., k) with, for each row, the matched column or -1.
+    """
+    d = d.copy()
+    k = d.shape[-1]
+    match = np.full(d.shape[:-1], -1)
+    flat = d.reshape(-1, k * k)
+    match_flat = match.reshape(-1, k)
+    rows = np.arange(flat.shape[0])
+    for _ in range(k):
+        best = np.argmin(flat, axis=-1)
+        ok = np.isfinite(flat[rows, best])
+        if not np.any(ok):
+            break
+        i, j = np.divmod(best[ok], k)
+        match_flat[rows[ok], i] = j
+        flat3 = flat.reshape(-1, k, k)
+        flat3[rows[ok], i, :] = np.inf
+        flat3[rows[ok], :, j] = np.inf
+    return match
+
+def _solve_2l(sep, q, zeta, tol=1e-6, newton=2, jacobian=True):
+    """Images, mask of true images and Jacobian, in the lens_equation_2l frame.
+
+    If jacobian is False, W_2 at the images is returned instead of the
+    Jacobian.
+    """
+    sep, q, zeta = np.broadcast_arrays(np.asarray(sep, dtype=float),
+        np.asarray(q, dtype=float), np.asarray(zeta, dtype=complex))
+
+    # Solve in the frame centered on the secondary: for small q, the images
+    # close to the secondary are clustered at the scale of its Einstein
+    # radius, and the roots are only accurate if they are small numbers
+    m1 = 1.0 / (1.0 + q)
+    m2 = q / (1.0 + q)
+    z1 = sep
+    z2 = np.zeros_like(sep)
+    zeta = zeta + z1
+    # The polynomial is degenerate if a source is exactly on a lens
+    for zl in [z1, z2]:
+        zeta = np.where(np.abs(zeta - zl) < 1e-12, zeta + 1e-12, zeta)
+    images = polyroots(_image_polynomial_2l(z1, z2, m1, m2, zeta))
+
+    # Polish the roots with Newton iterations on the lens equation itself,
+    # which is better conditioned than the polynomial close to the lenses
+    affix = np.stack([z1, z2], axis=-1)[..., None, :]
+    mass_fraction = np.stack([m1, m2], axis=-1)[..., None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(newton):
+            w_1, w_2 = wk_orders(images, affix, mass_fraction, [1, 2])
+            f = images - np.conj(w_1) - zeta[..., None]
+            a = np.conj(w_2)
+            dz = - (f + a * np.conj(f)) / (1.0 - np.abs(a)**2)
+            images = np.where(np.isfinite(dz), images + dz, images)
+    w_1, w_2 = wk_orders(images, affix, mass_fraction, [1, 2])
+    residual = np.abs(zeta[..., None] - images + np.conj(w_1))
+
+    # Roots that converged to the same image are counted once
+    order = np.argsort(residual, axis=-1)
+    images = np.take_along_axis(images, order, axis=-1)
+    residual = np.take_along_axis(residual, order, axis=-1)
+    w_2 = np.take_along_axis(w_2, order, axis=-1)
+    duplicate = np.zeros(images.shape, dtype=bool)
+    for i in range(1, 5):
+        duplicate[..., i] = np.any(np.abs(images[..., i:i+1] - images[..., :i])
+                                   < 1e-8 * (1 + np.abs(images[..., i:i+1])), axis=-1)
+    mask = (residual < tol) & ~duplicate
+    n_true = np.sum(mask, axis=-1)
+    n_images = np.where(n_true >= 5, 5, np.where(n_true >= 3, 3, n_true))
+    mask = mask & (np.cumsum(mask, axis=-1) <= n_images[..., None])
+
+    # Close to a fold, two almost identical false roots may pass the test on
+    # the residual. The parities of five images must add up to -1: if they
+    # do not and the two closest images have the same parity, they are false
+    parity = np.sign(1.0 - np.abs(w_2)**2)
+    total = np.sum(np.where(mask, parity, 0), axis=-1)
+    d = np.abs(images[..., :, None] - images[..., None, :])
+    d = np.where(mask[..., :, None] & mask[..., None, :]
+                 & ~np.eye(5, dtype=bool), d, np.inf)
+    i, j = np.divmod(np.argmin(d.reshape(d.shape[:-2] + (25,)), axis=-1), 5)
+    p_i = np.take_along_axis(parity, i[..., None], axis=-1)[..., 0]
+    p_j = np.take_along_axis(parity, j[..., None], axis=-1)[..., 0]
+    false = (np.sum(mask, axis=-1) == 5) & (total != -1) & (p_i == p_j)\
+        & (total - 2 * p_i == -1)
+    for k in [i, j]:
+        np.put_along_axis(mask, k[..., None], np.where(false[..., None], False,
+            np.take_along_axis(mask, k[..., None], axis=-1)), axis=-1)
+
+    if jacobian:
+        w_2 = 1.0 - np.abs(w_2)**2
+    return images - z1[..., None], mask, w_2
+
+def _image_polynomial_2l(z1, z2, m1, m2, zeta):
+    """Coefficients of the binary-lens image polynomial, for real z1 and z2."""
+    zetab = np.conj(zeta)
+    one = np.ones_like(zeta)
+    d = np.stack([one, -(z1 + z2) * one, z1 * z2 * one], axis=-1)
+    n = zetab[..., None] * d
+    n[..., 1] += 1
+    n[..., 2] -= m1 * z2 + m2 * z1
+    p1 = n - z1[..., None] * d
+    p2 = n - z2[..., None] * d
+    return _polyadd(
+        _polymul(_polymul(np.stack([-one, zeta], axis=-1), p1), p2),
+        _polymul(d, m1[..., None] * p2 + m2[..., None] * p1))
+
+def _frame_to_primary_2l(z, sep, q, frame):
+    """Move positions from a frame to the frame of lens_equation_2l."""
+    primary = LensReferenceFrame(center='primary', x_axis='21')
+    gl1 = np.asarray(sep) * np.asarray(q) / (1.0 + np.asarray(q))
+    return frame.to_frame(z, primary, sep=sep, gl1=gl1)
+
+def _primary_to_frame_2l(z, sep, q, frame):
+    """Move positions from the frame of lens_equation_2l to a frame."""
+    primary = LensReferenceFrame(center='primary', x_axis='21')
+    gl1 = np.asarray(sep) * np.asarray(q) / (1.0 + np.asarray(q))
+    if np.ndim(gl1) > 0:
+        # The images have one more axis than sep and q
+        sep, gl1 = np.asarray(sep)[..., None], gl1[..., None]
+    return primary.to_frame(z, frame, sep=sep, gl1=gl1)
 
 def wide_limit_2l(q: np.ndarray) -> np.ndarray:
     """Compute the limit between resonant and wide-separation caustics.
@@ -379,6 +1583,11 @@ def wide_limit_2l(q: np.ndarray) -> np.ndarray:
 def close_limit_2l(q: np.ndarray) -> np.ndarray:
     """Compute the limit between resonant and close-separation caustics.
 
+    The limit d satisfies (1 - d^4)^3 = 27 q d^8 / (1 + q)^2. With
+    u = 1 - d^4, this is the cubic c u^3 - u^2 + 2u - 1 = 0, where
+    c = (1 + q)^2 / (27 q), whose root in (0, 1) is computed for all q at
+    once with Cardano's formula, then polished with Newton's method.
+
     Args:
         q: list of lens mass ratios.
 
@@ -386,46 +1595,237 @@ def close_limit_2l(q: np.ndarray) -> np.ndarray:
         limit as a function of q.
 
     """
-    if np.atleast_1d(q).shape[0] > 1:
-        dc = np.array([close_limit_2l(a) for a in q])
-    else:
-        cc = (1.0 + q)**2 / (27.0 * q)
-
-        coeff = [cc, (1.0 - 3.0 * cc), 3.0 * cc, -cc]
-        x4 = np.roots(coeff)
-        dc = np.power(x4[np.where(np.abs(x4.imag) < 1e-10)].real[0], 1.0/4.0)
+    cc = (1.0 + np.asarray(q, dtype=float))**2 / (27.0 * np.asarray(q, dtype=float))
+
+    # Depressed cubic t^3 + p t + r = 0, with u = t + 1 / (3 cc)
+    b = -1.0 / cc
+    c = 2.0 / cc
+    d = -1.0 / cc
+    p = c - b**2 / 3.0
+    r = 2.0 * b**3 / 27.0 - b * c / 3.0 + d
+    sq = np.sqrt(np.asarray(r**2 / 4.0 + p**3 / 27.0, dtype=complex))
+    w = -0.5 * r + np.where(r > 0, -sq, sq)
+    cbrt = np.where(w == 0, 0.0, np.exp(np.log(w + (w == 0)) / 3.0))
+    roots = []
+    for k in range(3):
+        v = cbrt * np.exp(2j * np.pi * k / 3.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(v == 0, 0.0, v - p / (3.0 * v))
+        roots.append(t - b / 3.0)
+    roots = np.stack(roots, axis=-1)
+
+    # Real root in (0, 1)
+    score = np.abs(roots.imag) + np.where(
+        (roots.real > 0) & (roots.real < 1), 0.0, 1.0)
+    u = np.take_along_axis(roots.real, np.argmin(score, axis=-1)[..., None],
+                           axis=-1)[..., 0]
+    for _ in range(2):
+        u = u - (cc * u**3 - u**2 + 2 * u - 1) / (3 * cc * u**2 - 2 * u + 2)
+
+    dc = np.power(1.0 - u, 0.25)
+    if dc.ndim == 0:
+        dc = float(dc)
     return dc
 
-def shape(s: np.ndarray, q: np.ndarray) -> np.ndarray:
-    """Compute the limit between resonant and close-separation caustics.
+def shape(s: np.ndarray, q: np.ndarray, codes: bool = False) -> np.ndarray:
+    """Compute the topology of binary-lens caustics.
 
     Args:
-        s: list of separation values.
+        s: list of separation values, broadcast against q.
         q: list of lens mass ratios.
+        codes: if True, return compact int8 codes instead of str.
 
     Returns:
         list of str, where 'c' means close, 'r' means 'resonant', and 'w' means
-            wide'.
+            wide'. If codes is True, list of int8 where 0 means close, 1 means
+            resonant and 2 means wide.
 
     """
-    if np.atleast_1d(s).shape[0] > 1:
-        topology = np.array([shape(a, q) for a in s])
-    else:
-        dc = close_limit_2l(q)
-        dw = wide_limit_2l(q)
+    s, q = np.broadcast_arrays(np.asarray(s, dtype=float),
+                               np.asarray(q, dtype=float))
+    dc = close_limit_2l(q)
+    dw = wide_limit_2l(q)
+    topology = (s > dc).astype(np.int8) + (s > dw).astype(np.int8)
+
+    if not codes:
+        topology = np.array(['c', 'r', 'w'])[topology]
+    if topology.ndim == 0:
+        topology = topology.item()
+    return topology
 
-        if s <= dc:
-            topology = 'c'
-        elif ((s <= dw) & (s > dc)): 
-            topology = 'r'
-        else: 
-            topology = 'w'
+def caustic_geometry_2l(
+        s: np.ndarray,
+        q: np.ndarray,
+        n: int = 256,
+        niter: int = 8,
+        frame: Optional[LensReferenceFrame] = None,
+        chunk: int = 256) -> dict:
+    """Compute the geometry of many binary-lens caustics at once.
+
+    The critical points of all the lenses are computed with
+    :func:`critic_2l` for n angles, and the roots of consecutive angles are
+    matched using dz/dphi, so that each of the four roots follows a
+    continuous branch. The branches are then joined into closed caustics.
+
+    The cusps are the points where dzeta/dphi vanishes. With
+    W_2 = -exp(-i phi) on the critical curves of :func:`critic_2l`,
+    dz/dphi = -i W_2 / W_3 and dzeta/dphi is proportional to
+    Im(exp(-3 i phi / 2) / W_3), whose sign changes along the branches locate
+    the cusps. Their angle is then refined with a few steps of regula falsi,
+    the critical points being computed again at each step.
+
+    The central caustic is the caustic closest to the primary, and the
+    planetary caustic is the one with the largest ordinate among the others
+    (for close lenses, the two planetary caustics are symmetric).
 
-    return topology
+    Args:
+        s: list of separation values, broadcast against q.
+        q: list of lens mass ratios.
+        n: number of angles.
+        niter: number of iterations to refine the cusps.
+        frame: reference frame of the positions (default: frame of
+            :func:`lens_equation_2l`).
+        chunk: number of lenses computed at once, which bounds the memory
+            to about chunk * n critical points.
+
+    Returns:
+        Dictionary of arrays with the shape of the broadcast s and q:
+            ncaustics, ncusps, cusps (with an additional last axis of size
+            10, padded with NaN), and for the caustic (all the caustics),
+            the central and the planetary caustics: width, height, area and
+            center (center of the bounding box), e.g. 'width_central'. The
+            values of a missing planetary caustic are NaN.
+    """
+    s, q = np.broadcast_arrays(np.asarray(s, dtype=float),
+                               np.asarray(q, dtype=float))
+    shape_out = s.shape
+    s, q = s.ravel(), q.ravel()
+    m = s.shape[0]
+    parts = [_caustic_geometry_2l(s[i:i + chunk], q[i:i + chunk], n, niter)
+             for i in range(0, m, chunk)]
+    if len(parts) == 0:
+        parts = [_caustic_geometry_2l(s, q, n, niter)]
+    result = {key: np.concatenate([x[key] for x in parts])
+              for key in parts[0]}
+
+    # Reference frame and shape of the outputs
+    for key in result:
+        x = result[key]
+        if (frame is not None) & ((key == 'cusps') | key.startswith('center')):
+            x = _primary_to_frame_2l(x.reshape(m, -1), s, q, frame)
+        result[key] = x.reshape(shape_out + x.shape[1:]) if key == 'cusps'\
+            else x.reshape(shape_out)
+    return result
+
+def _caustic_geometry_2l(s: np.ndarray, q: np.ndarray, n: int,
+                         niter: int) -> dict:
+    """Geometry of the caustics of 1D arrays of lenses, in the frame of
+    :func:`lens_equation_2l`; see :func:`caustic_geometry_2l`."""
+    m = s.shape[0]
+    phi = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    dphi = 2 * np.pi / n
+
+    affix = np.stack([np.zeros(m), -s], axis=-1)[:, None, None, :]
+    eps = np.stack([1.0 / (1.0 + q), q / (1.0 + q)], axis=-1)[:, None, None, :]
+    z = critic_2l(s[:, None], q[:, None], phi[None, :]).reshape(m, n, 4)
+    w_1, w_2, w_3 = wk_orders(z, affix, eps, [1, 2, 3])
+
+    # Follow the branches
+    pred = z + (-1j * w_2 / w_3) * dphi
+    dist = np.abs(pred[..., :, None] - np.roll(z, -1, axis=1)[..., None, :])
+    perm = _greedy_match(dist)
+    labels = np.empty((m, n, 4), dtype=int)
+    labels[:, 0] = np.arange(4)
+    for i in range(n - 1):
+        labels[:, i + 1] = np.take_along_axis(perm[:, i], labels[:, i], axis=-1)
+    closure = np.take_along_axis(perm[:, -1], labels[:, -1], axis=-1)
+    z, w_1, w_3 = [np.take_along_axis(a, labels, axis=-1) for a in [z, w_1, w_3]]
+    zeta = z - np.conj(w_1)
+
+    # Closed caustics: smallest branch number of each cycle of closure
+    rep = np.arange(4)[None, :].repeat(m, axis=0)
+    nxt = closure.copy()
+    for _ in range(3):
+        rep = np.minimum(rep, nxt)
+        nxt = np.take_along_axis(closure, nxt, axis=-1)
+    comps = rep[:, :, None] == np.arange(4)[None, None, :]
+    exists = np.any(comps, axis=1)
+
+    # Bounding boxes and areas (Green's theorem) of the caustics
+    zeta_next = np.concatenate([zeta[:, 1:], np.take_along_axis(
+        zeta[:, :1], closure[:, None, :], axis=-1)], axis=1)
+    dA = 0.5 * np.sum(np.imag(np.conj(zeta) * zeta_next), axis=1)
+    def reduce(x, func, fill):
+        return func(np.where(comps, x[:, :, None], fill), axis=1)
+    xmin = reduce(zeta.real.min(axis=1), np.min, np.inf)
+    xmax = reduce(zeta.real.max(axis=1), np.max, -np.inf)
+    ymin = reduce(zeta.imag.min(axis=1), np.min, np.inf)
+    ymax = reduce(zeta.imag.max(axis=1), np.max, -np.inf)
+    area = np.abs(reduce(dA, np.sum, 0.0))
+    xmin, xmax, ymin, ymax = [np.where(exists, x, np.nan)
+                              for x in [xmin, xmax, ymin, ymax]]
+    center = 0.5 * (xmin + xmax) + 0.5j * (ymin + ymax)
+
+    rows = np.arange(m)
+    central = np.argmin(np.where(exists, np.abs(center), np.inf), axis=1)
+    others = exists & (np.arange(4)[None, :] != central[:, None])
+    planetary = np.argmax(np.where(others, center.imag, -np.inf), axis=1)
+    has_planetary = np.any(others, axis=1)
+
+    result = {'ncaustics': np.sum(exists, axis=1)}
+    result['width'] = np.max(np.where(exists, xmax, -np.inf), axis=1)\
+        - np.min(np.where(exists, xmin, np.inf), axis=1)
+    result['height'] = np.max(np.where(exists, ymax, -np.inf), axis=1)\
+        - np.min(np.where(exists, ymin, np.inf), axis=1)
+    result['area'] = np.sum(np.where(exists, area, 0.0), axis=1)
+    result['center'] = 0.5 * (np.max(np.where(exists, xmax, -np.inf), axis=1)
+        + np.min(np.where(exists, xmin, np.inf), axis=1))\
+        + 0.5j * (np.max(np.where(exists, ymax, -np.inf), axis=1)
+        + np.min(np.where(exists, ymin, np.inf), axis=1))
+    for name, k, ok in [('central', central, np.ones(m, dtype=bool)),
+                        ('planetary', planetary, has_planetary)]:
+        for key, x in [('width', xmax - xmin), ('height', ymax - ymin),
+                       ('area', area), ('center', center)]:
+            result[f'{key}_{name}'] = np.where(ok, x[rows, k], np.nan)
+
+    # Cusps: sign changes of Im(exp(-3 i phi / 2) / W_3) along the branches
+    f = np.imag(np.exp(-1.5j * phi)[None, :, None] / w_3)
+    f_next = np.concatenate([f[:, 1:], - np.take_along_axis(
+        f[:, :1], closure[:, None, :], axis=-1)], axis=1)
+    positive = f >= 0
+    positive_next = np.concatenate([positive[:, 1:], ~ np.take_along_axis(
+        positive[:, :1], closure[:, None, :], axis=-1)], axis=1)
+    model, step, branch = np.nonzero(positive != positive_next)
+    z_next = np.concatenate([z[:, 1:], np.take_along_axis(
+        z[:, :1], closure[:, None, :], axis=-1)], axis=1)
+    f_a, f_b = f[model, step, branch], f_next[model, step, branch]
+    t_a, t_b = np.zeros(model.shape[0]), np.full(model.shape[0], dphi)
+    z_cusp = z[model, step, branch] + f_a / (f_a - f_b)\
+        * (z_next[model, step, branch] - z[model, step, branch])
+    aff, ep = affix[model, 0, 0], eps[model, 0, 0]
+    for _ in range(niter):
+        # Illinois variant of the regula falsi, on the angle
+        t = t_b - f_b * (t_b - t_a) / (f_b - f_a)
+        roots = critic_2l(s[model], q[model], phi[step] + t).reshape(-1, 4)
+        nearest = np.argmin(np.abs(roots - z_cusp[:, None]), axis=-1)
+        z_cusp = roots[np.arange(roots.shape[0]), nearest]
+        f_t = np.imag(np.exp(-1.5j * (phi[step] + t)) / wk(z_cusp, aff, ep, 3))
+        swap = (f_t >= 0) != (f_b >= 0)
+        t_a, f_a = np.where(swap, t_b, t_a), np.where(swap, f_b, 0.5 * f_a)
+        t_b, f_b = t, f_t
+    zeta_cusp = z_cusp - np.conj(wk(z_cusp, aff, ep, 1))
+
+    result['ncusps'] = np.bincount(model, minlength=m)
+    cusps = np.full((m, 10), np.nan, dtype=complex)
+    rank = np.arange(model.shape[0]) - np.searchsorted(model, model)
+    keep = rank < 10
+    cusps[model[keep], rank[keep]] = zeta_cusp[keep]
+    result['cusps'] = cusps
+    return result
 
 def wkl2(k, s, q, z):
     n = k - 1
-    w = ( np.power(-1, n) * np.math.factorial(n) / (1 + q) )\
+    w = ( np.power(-1, n) * math.factorial(n) / (1 + q) )\
         * ( 1.0 / np.power(z, k) + q / np.power(z + s, k) )
     return w
 
@@ -445,36 +1845,245 @@ def wk(z: complex,
     assume that we have N point lenses in what follows.
 
     Args:
-        z: affix of the point where W_k(z) is evaluated.
+        z: affix of the point where W_k(z) is evaluated. It may be an array of
+            any shape.
         affix: array (shape: N, type: complex) of the affix of each point
             lenses.
         mass_fraction: array (shape N, type: float) with the corresponding mass
             fractions.
         k: order of the function W_k(z).
 
+    .. seealso::
+        :func:`moana.lens.wk_orders` to evaluate several orders at once.
+
     """
-    n = k - 1
-    w = np.power(-1, n) * np.math.factorial(n)
-    if not affix.shape[0] == mass_fraction.shape[0]:
+    return wk_orders(z, affix, mass_fraction, [k])[0]
+
+def wk_orders(z: np.ndarray,
+    affix: np.ndarray,
+    mass_fraction: np.ndarray,
+    orders: list) -> np.ndarray:
+    """Evaluate the function W_k(z) for several orders k at once.
+
+    The inverse distances (z - affix)^-1 are computed only once, and the
+    successive powers are obtained by recurrence, so that all the requested
+    orders cost about as much as the highest one.
+
+    The lenses are stored along the last axis of `affix` and `mass_fraction`,
+    which are broadcast against `z[..., None]`. For example, `z` with shape
+    (M, P) and `affix` with shape (M, 1, N) evaluate M different lens
+    configurations at P points each.
+
+    Args:
+        z: array of any shape of the points where W_k(z) is evaluated.
+        affix: array (shape: ..., N, type: complex) of the affix of each point
+            lenses.
+        mass_fraction: array (shape ..., N, type: float) with the corresponding
+            mass fractions.
+        orders: list of the orders k >= 1 of W_k(z).
+
+    Returns:
+        Array with shape (len(orders),) + z.shape, where the i-th element is
+            W_k(z) for k = orders[i].
+
+    """
+    affix = np.asarray(affix)
+    mass_fraction = np.asarray(mass_fraction)
+    if not affix.shape[-1] == mass_fraction.shape[-1]:
         sys.exit("Error: not the same number of mass fractions and lenses.")
-    x = 0
+    orders = np.atleast_1d(orders).astype(int)
+
+    inv = 1.0 / (np.asarray(z)[..., None] - affix)
+    w = np.empty((orders.shape[0],) + inv.shape[:-1], dtype=complex)
+    x = inv
+    for k in range(1, orders.max() + 1):
+        if k > 1:
+            x = x * inv
+        n = k - 1
+        for i in np.flatnonzero(orders == k):
+            w[i] = (-1)**n * math.factorial(n) * np.sum(mass_fraction * x, axis=-1)
+    return w
+
+def critic_nl(affix: np.ndarray,
+    mass_fraction: np.ndarray,
+    phi: np.ndarray) -> np.ndarray:
+    """Compute the critical points of N point lenses (Witt, 1990).
+
+    The critical points satisfy W_2(z) = exp(-i phi), i.e.,
+    prod_j (z - z_j)^2 - exp(i phi) sum_i eps_i prod_{j != i} (z - z_j)^2 = 0,
+    a polynomial of degree 2N solved for all the angles at once with
+    :func:`polyroots`.
+
+    Args:
+        affix: array (shape: N, type: complex) of the affix of each point
+            lenses.
+        mass_fraction: array (shape N, type: float) with the corresponding mass
+            fractions.
+        phi: array of any shape of the angle parameter in [0,2*pi].
+
+    Returns:
+        numpy array (shape: phi.shape + (2N,)) of the complex roots.
+    """
+    affix = np.atleast_1d(np.asarray(affix, dtype=complex))
+    mass_fraction = np.atleast_1d(np.asarray(mass_fraction, dtype=float))
+    if not affix.shape[-1] == mass_fraction.shape[-1]:
+        sys.exit("Error: not the same number of mass fractions and lenses.")
+
+    factors = [np.array([1.0, -2 * a, a**2]) for a in affix]
+    prod = np.array([1.0 + 0j])
+    for x in factors:
+        prod = _polymul(prod, x)
+    others = np.zeros(1)
     for i in range(affix.shape[0]):
-            x += mass_fraction[i] / np.power(z-affix[i], k)
-    return w * x
+        term = np.array([mass_fraction[i] + 0j])
+        for j in range(affix.shape[0]):
+            if not j == i:
+                term = _polymul(term, factors[j])
+        others = _polyadd(others, term)
+
+    eiphi = np.exp(1j * np.asarray(phi, dtype=float))[..., None]
+    coefs = _polyadd(prod, - eiphi * others)
+    return polyroots(coefs)
+
+def lens_equation_nl(affix: np.ndarray,
+    mass_fraction: np.ndarray,
+    z: np.ndarray) -> np.ndarray:
+    """Map positions of the lens plane to the source plane, for N lenses.
+
+    Args:
+        affix: array (shape: N, type: complex) of the affix of each point
+            lenses.
+        mass_fraction: array (shape N, type: float) with the corresponding mass
+            fractions.
+        z: array of any shape of the positions in the lens plane.
+
+    Returns:
+        numpy array of the corresponding position in the source plane
+    """
+    return np.asarray(z) - np.conj(wk(z, affix, mass_fraction, 1))
+
+
+class MultipleLensCaustic:
+    """Sample the critical curves and the caustics of N point lenses.
+
+    Args:
+        affix: array (shape: N, type: complex) of the affix of each point
+            lenses.
+        mass_fraction: array (shape N, type: float) with the corresponding mass
+            fractions.
+
+    """
+
+    def __init__(self,
+            affix: np.ndarray,
+            mass_fraction: np.ndarray):
+
+        self.affix = np.atleast_1d(np.asarray(affix, dtype=complex))
+        self.mass_fraction = np.atleast_1d(np.asarray(mass_fraction, dtype=float))
+        self.full = None
+
+    def _sample(self, ntot: int = 200):
+        """Sample the critical curves and the caustics.
+
+        The critical points are computed for ntot angles with
+        :func:`critic_nl`. The roots of consecutive angles are connected by
+        matching the roots of an angle with the predictions, from dz/dphi,
+        of the roots of the previous angle. The branches are then joined at
+        phi = 2*pi into closed curves.
+
+        Args:
+            ntot: number of angles.
+
+        The result is stored in the attribute full, a table with columns:
+        curve (closed curve number), phi (increasing along each closed
+        curve), z (critical points) and zeta (caustic points).
+        """
+        phi = np.linspace(0, 2 * np.pi, ntot, endpoint=False)
+        z = critic_nl(self.affix, self.mass_fraction, phi)
+
+        # Match the roots of consecutive angles, including 2*pi and 0
+        w_2, w_3 = wk_orders(z, self.affix, self.mass_fraction, [2, 3])
+        pred = z + (-1j * w_2 / w_3) * (2 * np.pi / ntot)
+        dist = np.abs(pred[:, :, None] - np.roll(z, -1, axis=0)[:, None, :])
+        perm = _greedy_match(dist).tolist()
+
+        # Relabel the roots so that each column is a continuous branch
+        nroots = z.shape[1]
+        labels = [list(range(nroots))]
+        for i in range(ntot - 1):
+            labels.append([perm[i][j] for j in labels[i]])
+        z = np.take_along_axis(z, np.array(labels), axis=1)
+        # Branch continuing each branch at 2*pi: the roots at phi = 0 are
+        # not relabelled, so their index is the branch number
+        closure = [perm[-1][j] for j in labels[-1]]
+
+        # Join the branches into closed curves
+        zeta = lens_equation_nl(self.affix, self.mass_fraction, z)
+        tables = []
+        todo = list(range(nroots))
+        curve = 0
+        while len(todo) > 0:
+            branch = todo[0]
+            k = 0
+            while branch in todo:
+                todo.remove(branch)
+                tables.append(pd.DataFrame({'curve': curve,
+                    'phi': phi + 2 * np.pi * k, 'z': z[:, branch],
+                    'zeta': zeta[:, branch]}))
+                branch = closure[branch]
+                k += 1
+            curve += 1
+        self.z = z
+        self.zeta = zeta
+        self.full = pd.concat(tables, ignore_index=True)
 
 
 # GENERAL FUNCTIONS
 
-def back_in_pipi(x):
-    if np.atleast_1d(x).shape[0] > 1:
-        return np.array([back_in_pipi(a) for a in x])
-    if x > 180:
-        return back_in_pipi(x - 360)
-    elif x < -180:
-        return back_in_pipi(x + 360)
-    else:
-        return x
+def polyroots(coefs: np.ndarray) -> np.ndarray:
+    """Compute the roots of many polynomials of the same degree at once.
 
+    This is a batched version of :func:`numpy.roots`: the companion matrices
+    of all the polynomials are stacked and their eigenvalues are computed in
+    a single call, which avoids the overhead of one :func:`numpy.roots` per
+    polynomial.
 
+    Args:
+        coefs: array (shape: ..., n+1) of the polynomial coefficients, highest
+            degree first. The leading coefficients must not vanish.
 
+    Returns:
+        Array (shape: ..., n, type: complex) of the roots.
+    """
+    coefs = np.asarray(coefs)
+    n = coefs.shape[-1] - 1
+    companion = np.zeros(coefs.shape[:-1] + (n, n), dtype=complex)
+    companion[..., 0, :] = - coefs[..., 1:] / coefs[..., :1]
+    companion[..., np.arange(1, n), np.arange(n - 1)] = 1
+    return np.linalg.eigvals(companion)
+
+
+def _polymul(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Multiply batches of polynomials (coefficients on the last axis)."""
+    n = a.shape[-1] + b.shape[-1] - 1
+    shape = np.broadcast_shapes(a.shape[:-1], b.shape[:-1])
+    c = np.zeros(shape + (n,), dtype=np.result_type(a, b))
+    for i in range(a.shape[-1]):
+        c[..., i:i + b.shape[-1]] += a[..., i:i+1] * b
+    return c
+
+def _polyadd(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Add batches of polynomials (coefficients on the last axis)."""
+    n = max(a.shape[-1], b.shape[-1])
+    a = np.concatenate([np.zeros(a.shape[:-1] + (n - a.shape[-1],)), a], axis=-1)
+    b = np.concatenate([np.zeros(b.shape[:-1] + (n - b.shape[-1],)), b], axis=-1)
+    return a + b
 
+def back_in_pipi(x):
+    """Bring angles in degrees back into [-180, 180]."""
+    x = np.asarray(x, dtype=float)
+    y = np.mod(x + 180, 360) - 180
+    y = np.where((y == -180) & (x > 0), 180.0, y)
+    if y.ndim == 0:
+        return float(y)
+    return y
@@ -0,0 +1,17 @@
+import numpy as np
+import os
+
+def save_npz_atomic(fname: str, **kwargs):
+    """Save arrays in a .npz file that is never seen partially written.
+
+    The arrays are written in a temporary file of the same directory, which
+    then replaces fname, so that concurrent readers (or a resumed run after
+    an interruption) see either the previous file or the complete new one.
+
+    Args:
+        fname: name of the .npz file.
+        kwargs: arrays to save, as in :func:`numpy.savez`.
+    """
+    tmp = f'{fname}.{os.getpid()}.tmp.npz'
+    np.savez(tmp, **kwargs)
+    os.replace(tmp, fname)
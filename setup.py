@@ -53,6 +53,7 @@ install_requires = setuptools_args['install_requires'] = [
 ]
 
 extras_require = setuptools_args['extras_require'] = {
+                                                      'parquet': ['pyarrow'],
 }
 
 if 'setuptools' in sys.modules:
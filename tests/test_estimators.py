@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from moana.estimators import SampledPosterior, StreamedPosterior
+
+LABELS = ['a', 'b', 'c']
+LIMIT = [0.0228, 0.1585, 0.5, 0.8415, 0.9772]
+
+
+@pytest.fixture
+def sample():
+    rng = np.random.default_rng(0)
+    n = 20000
+    return pd.DataFrame({'a': rng.normal(size=n), 'b': rng.exponential(size=n),
+                         'c': rng.uniform(-1, 3, n),
+                         'w': rng.integers(1, 5, n).astype(float)})
+
+
+def assert_quantiles_close(ci, expected, atol):
+    for l in expected:
+        np.testing.assert_allclose(ci[l], expected[l], atol=atol)
+
+
+def test_quantiles_of_each_label(sample):
+    posterior = SampledPosterior(sample, LABELS, limit=LIMIT)
+    for l in LABELS:
+        np.testing.assert_array_equal(posterior.ci[l],
+                                      posterior.find_limits(l, LIMIT))
+        np.testing.assert_allclose(posterior.ci[l], np.quantile(sample[l],
+            LIMIT, method='interpolated_inverted_cdf'), rtol=1e-12)
+
+
+def test_equal_weights_are_unweighted(sample):
+    unweighted = SampledPosterior(sample, LABELS, limit=LIMIT)
+    weighted = SampledPosterior(sample, LABELS, limit=LIMIT,
+                                weights=np.full(len(sample), 0.5))
+    for l in LABELS:
+        np.testing.assert_allclose(weighted.ci[l], unweighted.ci[l],
+                                   rtol=1e-12)
+
+
+def test_weights_are_repeated_rows(sample):
+    weighted = SampledPosterior(sample, LABELS, limit=LIMIT, weights='w')
+    by_array = SampledPosterior(sample, LABELS, limit=LIMIT,
+                                weights=sample['w'].to_numpy())
+    repeated = SampledPosterior(sample.loc[sample.index.repeat(sample['w'])],
+                                LABELS, limit=LIMIT)
+    assert_quantiles_close(weighted.ci, by_array.ci, atol=0)
+    assert_quantiles_close(weighted.ci, repeated.ci, atol=2e-3)
+
+
+def chunks(sample, size=3000):
+    return [sample.iloc[i:i + size] for i in range(0, len(sample), size)]
+
+
+@pytest.mark.parametrize('weights', [None, 'w'])
+def test_streamed_quantiles(sample, weights):
+    nbins = 10**4
+    in_memory = SampledPosterior(sample, LABELS, limit=LIMIT, weights=weights)
+    streamed = StreamedPosterior(chunks(sample), LABELS, limit=LIMIT,
+                                 weights=weights, nbins=nbins)
+    assert streamed.nsamples == len(sample)
+    # The streamed quantiles are resolved to the bin size, and the in-memory
+    # ones to the distance between the samples around them
+    for l in LABELS:
+        x = np.sort(sample[l].to_numpy())
+        k = np.searchsorted(x, in_memory.ci[l])
+        gap = x[np.minimum(k + 1, len(x) - 1)] - x[np.maximum(k - 2, 0)]
+        width = (x[-1] - x[0]) / nbins
+        assert np.all(np.abs(streamed.ci[l] - in_memory.ci[l])
+                      <= 2 * width + gap)
+
+
+def test_streamed_files(sample, tmp_path):
+    ranges = {l: (sample[l].min(), sample[l].max()) for l in LABELS}
+    options = dict(limit=LIMIT, nbins=1000, chunksize=3000)
+    reference = StreamedPosterior(chunks(sample), LABELS, ranges=ranges,
+                                  **options)
+
+    fname = str(tmp_path / 'sample.csv')
+    sample.to_csv(fname, index=False)
+    from_csv = StreamedPosterior(fname, LABELS, **options)
+
+    fname = str(tmp_path / 'sample.npy')
+    np.save(fname, sample.to_numpy())
+    from_npy = StreamedPosterior(fname, LABELS, names=list(sample.columns),
+                                 **options)
+
+    for streamed in [from_csv, from_npy]:
+        assert streamed.nsamples == len(sample)
+        for l in LABELS:
+            np.testing.assert_array_equal(streamed.hist[l][1],
+                                          reference.hist[l][1])
+        assert_quantiles_close(streamed.ci, reference.ci, atol=1e-12)
+
+
+def test_streamed_ranges_need_two_readings(sample):
+    with pytest.raises(SystemExit):
+        StreamedPosterior(iter(chunks(sample)), LABELS)
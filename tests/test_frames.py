@@ -0,0 +1,76 @@
+import itertools
+import numpy as np
+import pytest
+
+from moana.frames import FrameTransform, LensReferenceFrame
+
+FRAMES = [LensReferenceFrame(center=c, x_axis=x) for c, x in itertools.product(
+    ['primary', 'secondary', 'barycenter'], ['12', '21'])]
+PAIRS = list(itertools.product(FRAMES, FRAMES))
+SEP, GL1 = 1.3, 0.2
+
+
+def lenses(frame):
+    """Positions of the primary and secondary in a frame."""
+    origin = {'primary': 0.0, 'secondary': SEP, 'barycenter': GL1}
+    z = np.array([0.0, SEP]) - origin[frame.center]
+    return z if frame.x_axis == '12' else - z
+
+
+def name(frame):
+    return f'{frame.center}-{frame.x_axis}'
+
+
+@pytest.mark.parametrize('old, new', PAIRS, ids=[
+    f'{name(a)}-to-{name(b)}' for a, b in PAIRS])
+def test_lens_positions(old, new):
+    z = old.to_frame(lenses(old), new, sep=SEP, gl1=GL1)
+    np.testing.assert_allclose(z, lenses(new), atol=1e-15)
+
+
+@pytest.mark.parametrize('old, new', PAIRS, ids=[
+    f'{name(a)}-to-{name(b)}' for a, b in PAIRS])
+def test_round_trip(old, new):
+    rng = np.random.default_rng(0)
+    z = rng.normal(size=10) + 1j * rng.normal(size=10)
+    sep = rng.uniform(0.5, 2.0, 10)
+    gl1 = 0.1 * sep
+    back = new.to_frame(old.to_frame(z, new, sep=sep, gl1=gl1), old,
+                        sep=sep, gl1=gl1)
+    np.testing.assert_allclose(back, z, atol=1e-14)
+    assert old.transform(new).inverse() == new.transform(old)
+    assert old.transform(new).then(new.transform(old)) == FrameTransform()
+
+
+def test_composition():
+    rng = np.random.default_rng(1)
+    z = rng.normal(size=5) + 1j * rng.normal(size=5)
+    for a, b, c in itertools.product(FRAMES, repeat=3):
+        assert a.transform(b).then(b.transform(c)) == a.transform(c)
+        np.testing.assert_allclose(
+            b.to_frame(a.to_frame(z, b, sep=SEP, gl1=GL1), c, sep=SEP, gl1=GL1),
+            a.to_frame(z, c, sep=SEP, gl1=GL1), atol=1e-14)
+
+
+def test_broadcast_and_out():
+    old, new = FRAMES[0], FRAMES[5]
+    sep = np.array([1.0, 2.0, 3.0])
+    z = old.to_frame(0.1 + 0.2j, new, sep=sep, gl1=0.1 * sep)
+    assert z.shape == (3,)
+    np.testing.assert_allclose(z, [old.to_frame(0.1 + 0.2j, new, sep=a,
+                               gl1=0.1 * a) for a in sep])
+
+    z = np.array([0.1 + 0.2j, -0.3j, 1.0])
+    expected = old.to_frame(z, new, sep=SEP, gl1=GL1)
+    out = old.to_frame(z, new, sep=SEP, gl1=GL1, out=z)
+    assert out is z
+    np.testing.assert_array_equal(z, expected)
+
+
+def test_hash():
+    transforms = {a.transform(b) for a, b in PAIRS}
+    assert FrameTransform() in transforms
+    assert len(transforms) == len(set(map(repr, transforms)))
+    assert FrameTransform(conj=True, sign=-1, a=1) \
+        == FrameTransform(conj=True, sign=-1, a=1, b=0)
+    assert hash(FrameTransform(a=1)) == hash(FrameTransform(a=1))
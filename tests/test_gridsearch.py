@@ -0,0 +1,57 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+from moana.gridsearch import GridSearch
+
+
+def chi2(sep, q, alpha):
+    return (np.log10(sep) - 0.1)**2 + (np.log10(q) + 3)**2 + np.cos(alpha)
+
+
+def not_called(sep, q, alpha):
+    raise AssertionError('all the chunks should be read from the checkpoint')
+
+
+def search(fcn, checkpoint, **kwargs):
+    options = dict(shape=(4, 4, 3), nlevels=2, nkeep=3, chunk=16,
+                   processes=1, checkpoint=checkpoint)
+    return GridSearch(fcn, **dict(options, **kwargs))
+
+
+def test_resume_from_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / 'grid')
+    grid = search(chi2, checkpoint)
+    grid.run()
+    models = grid.models
+    assert models['chi2'].is_monotonic_increasing
+    np.testing.assert_allclose(models['chi2'],
+                               chi2(models['sep'], models['q'], models['alpha']))
+
+    # Everything is read from the checkpoint
+    resumed = search(not_called, checkpoint)
+    resumed.run()
+    pd.testing.assert_frame_equal(resumed.models, models)
+
+    # A missing chunk is computed again
+    files = sorted(os.listdir(checkpoint))
+    os.remove(os.path.join(checkpoint, files[-1]))
+    resumed = search(chi2, checkpoint)
+    resumed.run()
+    pd.testing.assert_frame_equal(resumed.models, models)
+    assert sorted(os.listdir(checkpoint)) == files
+
+
+@pytest.mark.parametrize('shape, alpha', [
+    ((1, 4, 3), (0.0, 2 * np.pi)), ((4, 1, 3), (0.0, 2 * np.pi)),
+    ((4, 4, 0), (0.0, 2 * np.pi)), ((4, 4, 1), (0.0, 1.0))])
+def test_first_grid_too_small(shape, alpha):
+    with pytest.raises(SystemExit):
+        GridSearch(chi2, shape=shape, alpha=alpha)
+
+
+def test_single_periodic_alpha():
+    grid = search(chi2, None, shape=(3, 3, 1))
+    grid.run()
+    assert np.all(np.isfinite(grid.models['alpha']))
@@ -0,0 +1,110 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+import moana.lens
+from moana.lens import (ResonantCaustic, caustic_atlas, close_limit_2l,
+                        load_caustic_atlas, magnification_fs_1l,
+                        magnification_fs_2l, shape, wide_limit_2l)
+
+# Resonant lenses where the flags of the branch tracker jumped across the
+# caustic with uniform sampling
+RESONANT = [(0.8, 0.1), (0.9, 0.3), (1.0, 1.0), (1.1, 0.1), (1.3, 0.3),
+            (1.0, 1e-3), (1.0, 1e-2)]
+
+
+def steps(caustic):
+    return np.abs(np.diff(caustic.zeta))
+
+
+@pytest.mark.parametrize('sep, q', RESONANT)
+def test_uniform_sampling_step(sep, q):
+    ntot = 400
+    caustic = ResonantCaustic(sep=sep, q=q)
+    caustic._sample(ntot, uniform=True, continuation=False, compact=True)
+    d = steps(caustic)
+    # ntot/2 points are uniform in curvilinear abscissa, the others refine
+    assert d.max() < 3 * d.sum() / (0.5 * ntot)
+
+
+@pytest.mark.parametrize('sep, q', RESONANT)
+def test_default_sampling_follows_branches(sep, q):
+    default = ResonantCaustic(sep=sep, q=q)
+    default._sample(400, compact=True)
+    uniform = ResonantCaustic(sep=sep, q=q)
+    uniform._sample(400, uniform=True, compact=True)
+    # A jump across the caustic is much larger than the uniform step
+    assert steps(default).max() < 5 * steps(uniform).max()
+
+
+def close_limit_roots(q):
+    """Close limit from the roots of the polynomial in d^4, one q at a time."""
+    cc = (1.0 + q)**2 / (27.0 * q)
+    x4 = np.roots([cc, 1.0 - 3.0 * cc, 3.0 * cc, -cc])
+    return x4[np.abs(x4.imag) < 1e-10].real[0]**0.25
+
+
+def test_close_limit_matches_roots():
+    q = np.geomspace(1e-8, 1.0, 200)
+    expected = np.array([close_limit_roots(a) for a in q])
+    np.testing.assert_allclose(close_limit_2l(q), expected, rtol=1e-10)
+    assert isinstance(close_limit_2l(1e-3), float)
+    assert close_limit_2l(1e-3) == pytest.approx(close_limit_roots(1e-3),
+                                                 rel=1e-10)
+
+
+def test_shape_codes():
+    q = np.geomspace(1e-6, 1.0, 50)
+    dc, dw = close_limit_2l(q), wide_limit_2l(q)
+    s = np.stack([0.99 * dc, 1.01 * dc, 0.99 * dw, 1.01 * dw])
+    codes = shape(s, q, codes=True)
+    assert codes.dtype == np.int8
+    np.testing.assert_array_equal(codes, np.array([0, 1, 1, 2])[:, None]
+                                  * np.ones(q.shape, dtype=int))
+    np.testing.assert_array_equal(shape(s, q), np.array(['c', 'r', 'w'])[codes])
+
+
+def test_shape_broadcast_and_scalar():
+    assert shape(1.0, 1e-3) == 'r'
+    assert shape(0.3, 1e-3, codes=True) == 0
+    assert shape(np.array([0.5, 1.0, 3.0])[:, None], np.array([1e-3, 1e-1]),
+                 codes=True).shape == (3, 2)
+
+
+def test_caustic_atlas_resumes(tmp_path):
+    path = str(tmp_path / 'atlas')
+    sep, q = [0.9, 1.0, 1.1], [1e-3, 1e-2]
+    options = dict(ntot=50, grid=True, chunk=4, processes=1)
+    assert caustic_atlas(sep, q, path, **options) == 2
+    full = load_caustic_atlas(path)
+    assert sorted(full['id'].unique()) == list(range(6))
+
+    # Only the missing chunk is computed again, with the same result
+    os.remove(os.path.join(path, 'chunk_000001.npz'))
+    assert len(load_caustic_atlas(path)['id'].unique()) == 4
+    assert caustic_atlas(sep, q, path, **options) == 1
+    assert caustic_atlas(sep, q, path, **options) == 0
+    pd.testing.assert_frame_equal(load_caustic_atlas(path), full)
+
+    with pytest.raises(SystemExit):
+        caustic_atlas(sep, q, path, **dict(options, ntot=60))
+
+
+@pytest.mark.parametrize('rho, offset', [(0.01, 0.0), (0.01, -5e-8),
+    (0.01, 1e-5), (0.3, 0.0), (0.3, -3e-6)])
+def test_finite_source_limb_on_lens(rho, offset):
+    # With q = 1e-9, the binary lens is a single lens, whose magnification
+    # is known; the source limb passes on (or very close to) the primary
+    u = rho * (1 + offset)
+    a = magnification_fs_2l(1.0, 1e-9, np.array([u + 0j]), rho, tol=1e-4)
+    assert a[0] == pytest.approx(magnification_fs_1l(u, rho, n=1024), rel=1e-4)
+
+
+def test_finite_source_failures_warn(monkeypatch):
+    monkeypatch.setattr(moana.lens, '_contour_magnification_2l',
+                        lambda *args: np.full(args[2].shape, 0.5))
+    zeta = np.linspace(-0.1, 0.1, 20) + 0j
+    with pytest.warns(RuntimeWarning, match='could not be computed'):
+        a = magnification_fs_2l(1.0, 1e-3, zeta, 0.01)
+    assert np.any(np.isnan(a))